@@ -1,18 +1,42 @@
 import asyncio
 import random
+from typing import Dict
 
 import discord
 from discord import app_commands, ui
 from discord.ext import commands
 
-from utils.blackjack import Blackjack
-from utils.money import Money
+from utils.blackjack import Blackjack, Shoe, card_name
+from utils.config import Settings
 
 
 class Casino(commands.GroupCog):
     def __init__(self, bot):
         self.bot = bot
-        self.money = Money(bot.database)
+        self.money = bot.money
+        self.settings = bot.config.settings.casino
+        # Guild ID -> the shoe its blackjack games are dealt from
+        self.shoes: Dict[int, Shoe] = {}
+
+    async def cog_load(self) -> None:
+        self.bot.config.subscribe(self.on_config_reload)
+
+    async def cog_unload(self) -> None:
+        self.bot.config.unsubscribe(self.on_config_reload)
+
+    async def on_config_reload(self, settings: Settings) -> None:
+        if settings.casino != self.settings:
+            # Games in progress keep their shoe; new games get a fresh one
+            self.shoes.clear()
+        self.settings = settings.casino
+
+    def _get_shoe(self, guild_id: int) -> Shoe:
+        shoe = self.shoes.get(guild_id)
+        if shoe is None:
+            shoe = self.shoes[guild_id] = Shoe(
+                self.settings.blackjack_decks, self.settings.blackjack_penetration
+            )
+        return shoe
 
     @app_commands.command()
     @app_commands.checks.cooldown(1, 3, key=lambda i: (i.guild_id, i.user.id))
@@ -27,10 +51,10 @@ class Casino(commands.GroupCog):
             return
 
         # Get user and guild IDs for database operations
-        user_id = str(interaction.user.id)
-        guild_id = str(interaction.guild.id)
+        user_id = interaction.user.id
+        guild_id = interaction.guild.id
 
-        if not self.money.lose(user_id, guild_id, wager):
+        if not await self.money.lose(user_id, guild_id, wager, "slots"):
             return await interaction.response.send_message(
                 "You don't have enough cookies to make this wager!"
             )
@@ -56,18 +80,18 @@ class Casino(commands.GroupCog):
         await interaction.edit_original_response(embed=embed)
         await asyncio.sleep(0.5)
 
-        def evaluate_slots(wheel1, wheel2, wheel3):
+        async def evaluate_slots(wheel1, wheel2, wheel3):
             if wheel1 == wheel2 == wheel3:
                 if interaction.guild:
                     payout = wager * 100
-                    self.money.earn(user_id, guild_id, payout)
+                    await self.money.earn(user_id, guild_id, payout, "slots")
                     embed.color = discord.Color.green()
                     return f"You won! Payout: {payout}"
             else:
                 embed.color = discord.Color.red()
                 return "Tough luck!"
 
-        embed.description = f"{wheel1} | {wheel2} | {wheel3}... {evaluate_slots(wheel1, wheel2, wheel3)}"
+        embed.description = f"{wheel1} | {wheel2} | {wheel3}... {await evaluate_slots(wheel1, wheel2, wheel3)}"
         await interaction.edit_original_response(embed=embed)
 
     class BlackjackView(ui.View):
@@ -103,7 +127,9 @@ class Casino(commands.GroupCog):
                 )
 
                 if payout > 0:
-                    self.money.earn(self.user_id, self.guild_id, payout)
+                    await self.money.earn(
+                        self.user_id, self.guild_id, payout, "blackjack"
+                    )
                     embed.add_field(name="Payout", value=f"{payout}", inline=False)
 
                     if payout == self.wager:
@@ -122,20 +148,13 @@ class Casino(commands.GroupCog):
             dealer_hand, player_hand = self.game.get_table()
 
             if self.ended:
-                dealer_cards = " | ".join(
-                    [f"{card.rank} of {card.suit}" for card in dealer_hand]
-                )
-                dealer_total = self.game.calculate_hand(dealer_hand)
-                dealer_display = f"{dealer_cards} (Total: {dealer_total})"
+                dealer_cards = " | ".join([card_name(card) for card in dealer_hand])
+                dealer_display = f"{dealer_cards} (Total: {dealer_hand.total})"
             else:
-                dealer_display = (
-                    f"{dealer_hand[0].rank} of {dealer_hand[0].suit} | Hidden card"
-                )
+                dealer_display = f"{card_name(dealer_hand.cards[0])} | Hidden card"
 
-            player_cards = " | ".join(
-                [f"{card.rank} of {card.suit}" for card in player_hand]
-            )
-            player_total = self.game.calculate_hand(player_hand)
+            player_cards = " | ".join([card_name(card) for card in player_hand])
+            player_total = player_hand.total
 
             embed = discord.Embed(
                 title=f"{self.user_display_name}'s blackjack game",
@@ -153,12 +172,12 @@ class Casino(commands.GroupCog):
 
         @ui.button(label="Hit", style=discord.ButtonStyle.primary)
         async def hit_button(self, interaction: discord.Interaction, button: ui.Button):
-            if interaction.user.id != int(self.user_id):
+            if interaction.user.id != self.user_id:
                 return await interaction.response.send_message(
                     "This isn't your game!", ephemeral=True
                 )
 
-            continue_game = self.game.hit(self.game.player_hand)
+            continue_game = self.game.hit()
 
             embed = self.create_game_embed()
 
@@ -177,7 +196,7 @@ class Casino(commands.GroupCog):
         async def stand_button(
             self, interaction: discord.Interaction, button: ui.Button
         ):
-            if interaction.user.id != int(self.user_id):
+            if interaction.user.id != self.user_id:
                 return await interaction.response.send_message(
                     "This isn't your game!", ephemeral=True
                 )
@@ -191,7 +210,7 @@ class Casino(commands.GroupCog):
             embed.add_field(name="Result", value=result, inline=False)
 
             if payout > 0:
-                self.money.earn(self.user_id, self.guild_id, payout)
+                await self.money.earn(self.user_id, self.guild_id, payout, "blackjack")
                 embed.add_field(name="Payout", value=f"{payout}", inline=False)
 
                 if payout == self.wager:
@@ -216,39 +235,35 @@ class Casino(commands.GroupCog):
             return
 
         # Get user and guild IDs for database operations
-        user_id = str(interaction.user.id)
-        guild_id = str(interaction.guild.id)
+        user_id = interaction.user.id
+        guild_id = interaction.guild.id
 
-        if not self.money.lose(user_id, guild_id, wager):
+        if not await self.money.lose(user_id, guild_id, wager, "blackjack"):
             return await interaction.response.send_message(
                 "You don't have enough cookies to make this wager!"
             )
 
-        game = Blackjack(wager)
+        game = Blackjack(wager, self._get_shoe(guild_id))
         game.initial_deal()
 
         dealer_hand, player_hand = game.get_table()
-        player_total = game.calculate_hand(player_hand)
+        player_total = player_hand.total
 
-        if player_total == 21 and len(player_hand) == 2:
+        if player_hand.is_blackjack:
             result, payout = game.stand()
-            dealer_total = game.calculate_hand(dealer_hand)
+            dealer_total = dealer_hand.total
 
             embed = discord.Embed(
                 title=f"{interaction.user.display_name}'s blackjack game",
                 color=discord.Color.yellow(),
             )
 
-            dealer_cards = " | ".join(
-                [f"{card.rank} of {card.suit}" for card in dealer_hand]
-            )
+            dealer_cards = " | ".join([card_name(card) for card in dealer_hand])
             embed.add_field(
                 name=f"Dealer's Hand ({dealer_total})", value=dealer_cards, inline=False
             )
 
-            player_cards = " | ".join(
-                [f"{card.rank} of {card.suit}" for card in player_hand]
-            )
+            player_cards = " | ".join([card_name(card) for card in player_hand])
             embed.add_field(
                 name=f"Your Hand ({player_total})", value=player_cards, inline=False
             )
@@ -256,7 +271,7 @@ class Casino(commands.GroupCog):
             embed.add_field(name="Wager", value=str(wager), inline=False)
 
             if result == "Blackjack":
-                self.money.earn(user_id, guild_id, payout)
+                await self.money.earn(user_id, guild_id, payout, "blackjack")
                 embed.add_field(
                     name="Result",
                     value=f"Natural Blackjack! You won {payout} cookies!",
@@ -264,7 +279,7 @@ class Casino(commands.GroupCog):
                 )
                 embed.color = discord.Color.green()
             elif result == "Push":
-                self.money.earn(user_id, guild_id, payout)
+                await self.money.earn(user_id, guild_id, payout, "blackjack")
                 embed.add_field(
                     name="Result",
                     value="Push! Both you and dealer have natural blackjack.",
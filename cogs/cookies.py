@@ -1,17 +1,29 @@
-import asyncio
+from collections import deque
+from typing import Deque, List, Optional, Tuple, cast
 
 import discord
-from discord import app_commands
-from discord.ext import commands
+from discord import app_commands, ui
+from discord.ext import commands, tasks
 
 from main import DiscordBot
-from utils.money import Money
+from utils.leaderboard import Leaderboard
 
 
 class Cookies(commands.GroupCog):
     def __init__(self, bot: DiscordBot) -> None:
         self.bot = bot
-        self.money = Money(bot.database)
+        self.money = bot.money
+
+    async def cog_load(self) -> None:
+        self.compact_ledger.start()
+
+    async def cog_unload(self) -> None:
+        self.compact_ledger.cancel()
+
+    @tasks.loop(hours=24)
+    async def compact_ledger(self) -> None:
+        """Rolls old ledger entries up into daily totals."""
+        await self.money.compact_ledger()
 
     @app_commands.command()
     async def amount(self, interaction: discord.Interaction, member: discord.User):
@@ -19,11 +31,88 @@ class Cookies(commands.GroupCog):
         if interaction.guild is None:
             return
 
-        cookies = self.money.get_money(member.id, interaction.guild.id)
+        cookies = await self.money.get_money(member.id, interaction.guild.id)
         await interaction.response.send_message(
             f"{member.display_name} has {cookies} cookies!"
         )
 
+    class LeaderboardView(ui.View):
+        PAGE_SIZE = 10
+
+        def __init__(self, board: Leaderboard, guild: discord.Guild):
+            super().__init__(timeout=120.0)
+            self.board = board
+            self.guild = guild
+            self.page = 0
+            # Board position each page starts at, as unresolvable rows are skipped
+            self.starts = [0]
+            self.message = None
+
+        def create_page_embed(self):
+            embed = discord.Embed(
+                title="🍪 Cookie Leaderboard",
+                description=f"Top Cookie Collectors! (Page {self.page + 1})",
+                color=discord.Color.gold(),
+            )
+
+            medals = {1: "🥇", 2: "🥈", 3: "🥉"}
+
+            # Stream entries until the page has enough members this guild can
+            # still resolve, plus one more to know whether there is a next page
+            rows = []
+            next_start = None
+            for position, user_id, cookies in self.board.entries(
+                self.starts[self.page]
+            ):
+                member = self.guild.get_member(user_id)
+                if member is None:
+                    continue
+                if len(rows) == self.PAGE_SIZE:
+                    next_start = position
+                    break
+                rows.append((member, cookies))
+
+            offset = self.page * self.PAGE_SIZE
+            for index, (member, cookies) in enumerate(rows, start=offset + 1):
+                rank = medals.get(index, f"#{index}")
+                name = f"{rank} {member.display_name}"
+                embed.add_field(name=name, value=f"{cookies:,} cookies", inline=False)
+
+            del self.starts[self.page + 1 :]
+            if next_start is not None:
+                self.starts.append(next_start)
+
+            self.previous_button.disabled = self.page == 0
+            self.next_button.disabled = next_start is None
+            return embed
+
+        async def on_timeout(self):
+            for item in self.children:
+                item.disabled = True
+
+            try:
+                await self.message.edit(view=self)
+            except Exception:
+                pass
+
+        @ui.button(label="Previous", style=discord.ButtonStyle.secondary)
+        async def previous_button(
+            self, interaction: discord.Interaction, button: ui.Button
+        ):
+            self.page = max(self.page - 1, 0)
+            await interaction.response.edit_message(
+                embed=self.create_page_embed(), view=self
+            )
+
+        @ui.button(label="Next", style=discord.ButtonStyle.secondary)
+        async def next_button(
+            self, interaction: discord.Interaction, button: ui.Button
+        ):
+            self.page = min(self.page + 1, len(self.starts) - 1)
+            await interaction.response.edit_message(
+                embed=self.create_page_embed(), view=self
+            )
+
     @app_commands.command()
     async def leaderboard(self, interaction: discord.Interaction):
         """Show the cookie leaderboard for this server!"""
@@ -33,41 +122,87 @@ class Cookies(commands.GroupCog):
             )
             return
 
-        guild_id = str(interaction.guild.id)
-        cursor = self.bot.database.cursor
-        cursor.execute(
-            """
-            SELECT user_id, cookies
-            FROM cookies
-            WHERE guild_id = ?
-            ORDER BY cookies DESC
-            LIMIT 10
-            """,
-            (guild_id,),
+        board = await self.money.leaderboards.get(interaction.guild.id)
+
+        if not len(board):
+            await interaction.response.send_message(
+                "No one has any cookies yet!", ephemeral=True
+            )
+            return
+
+        view = self.LeaderboardView(board, interaction.guild)
+        await interaction.response.send_message(
+            embed=view.create_page_embed(), view=view
         )
+        view.message = await interaction.original_response()
+
+    @app_commands.command()
+    async def rank(
+        self,
+        interaction: discord.Interaction,
+        member: Optional[discord.Member] = None,
+    ):
+        """Check where you or another member are on the leaderboard!"""
+        if interaction.guild is None:
+            await interaction.response.send_message(
+                "This command can only be used in a server!", ephemeral=True
+            )
+            return
 
-        rows = cursor.fetchall()
+        member = member or cast(discord.Member, interaction.user)
+        board = await self.money.leaderboards.get(interaction.guild.id)
 
-        if not rows:
+        if board.rank(member.id) is None:
             await interaction.response.send_message(
-                "No one has any cookies yet!", ephemeral=True
+                f"{member.display_name} isn't on the leaderboard yet!",
+                ephemeral=True,
             )
             return
 
+        # Numbered like the leaderboard, which skips rows the guild cannot resolve
+        place = 0
+        total = 0
+        above: Deque[Tuple[int, discord.Member, int]] = deque(maxlen=2)
+        below: List[Tuple[int, discord.Member, int]] = []
+        for _, user_id, cookies in board.entries():
+            other = (
+                member
+                if user_id == member.id
+                else interaction.guild.get_member(user_id)
+            )
+            if other is None:
+                continue
+
+            total += 1
+            if user_id == member.id:
+                place = total
+            elif not place:
+                above.append((total, other, cookies))
+            elif len(below) < 2:
+                below.append((total, other, cookies))
+
         embed = discord.Embed(
-            title="🍪 Cookie Leaderboard",
-            description="Top 10 Cookie Collectors!",
+            title=f"{member.display_name}'s Cookie Rank",
+            description=f"#{place} of {total}",
             color=discord.Color.gold(),
         )
+        embed.set_thumbnail(url=member.display_avatar.url)
 
-        medals = {1: "🥇", 2: "🥈", 3: "🥉"}
+        # Show two places above and below the member
+        neighbours = [
+            f"#{index} {other.display_name}: {cookies:,} cookies"
+            for index, other, cookies in above
+        ]
+        neighbours.append(
+            f"**#{place} {member.display_name}: "
+            f"{board.scores[member.id]:,} cookies**"
+        )
+        neighbours.extend(
+            f"#{index} {other.display_name}: {cookies:,} cookies"
+            for index, other, cookies in below
+        )
 
-        for index, (user_id, cookies) in enumerate(rows, start=1):
-            member = interaction.guild.get_member(int(user_id))
-            if member:
-                rank = medals.get(index, f"#{index}")
-                name = f"{rank} {member.display_name}"
-                embed.add_field(name=name, value=f"{cookies:,} cookies", inline=False)
+        embed.add_field(name="Nearby", value="\n".join(neighbours), inline=False)
 
         await interaction.response.send_message(embed=embed)
 
@@ -95,13 +230,11 @@ class Cookies(commands.GroupCog):
         recipient_id = recipient.id
         guild_id = interaction.guild.id
 
-        if not self.money.lose(sender_id, guild_id, amount):
+        if not await self.money.transfer(sender_id, recipient_id, guild_id, amount):
             return await interaction.response.send_message(
                 "You don't have enough cookies to give!"
             )
 
-        self.money.earn(recipient_id, guild_id, amount)
-
         await interaction.response.send_message(
             f"Transfer complete. {interaction.user.display_name} gives {recipient.display_name} {amount} cookies!"
         )
@@ -124,7 +257,7 @@ class Cookies(commands.GroupCog):
         user_id = member.id
         guild_id = interaction.guild.id
 
-        self.money.set_money(user_id, guild_id, amount)
+        await self.money.set_money(user_id, guild_id, amount)
         await interaction.response.send_message(
             f"{member.display_name} now has {amount} cookies!"
         )
@@ -143,17 +276,16 @@ class Cookies(commands.GroupCog):
         author_id = interaction.user.id
         guild_id = interaction.guild.id
 
-        if not self.money.lose(author_id, guild_id, 10):
+        if not await self.money.lose(author_id, guild_id, 10, "mute"):
             return await interaction.response.send_message(
                 "You don't have enough cookies to mute!"
             )
 
         await member.edit(mute=True)
+        await self.bot.scheduler.schedule(guild_id, member.id, "mute", 10)
         await interaction.response.send_message(
             f"{member.display_name} has been muted for 10 seconds! Enjoy the silence!"
         )
-        await asyncio.sleep(10)
-        await member.edit(mute=False)
 
     @app_commands.command()
     async def deafen(self, interaction: discord.Interaction, member: discord.Member):
@@ -169,17 +301,16 @@ class Cookies(commands.GroupCog):
         author_id = interaction.user.id
         guild_id = interaction.guild.id
 
-        if not self.money.lose(author_id, guild_id, 10):
+        if not await self.money.lose(author_id, guild_id, 10, "deafen"):
             return await interaction.response.send_message(
                 "You don't have enough cookies to mute!"
             )
 
         await member.edit(deafen=True)
+        await self.bot.scheduler.schedule(guild_id, member.id, "deafen", 10)
         await interaction.response.send_message(
             f"{member.display_name} has been deafened for 10 seconds! We're having so much fun without you!"
         )
-        await asyncio.sleep(10)
-        await member.edit(deafen=False)
 
     @app_commands.command()
     async def stats(self, interaction: discord.Interaction, member: discord.User):
@@ -193,10 +324,12 @@ class Cookies(commands.GroupCog):
         user_id = member.id
         guild_id = interaction.guild.id
 
-        current_cookies = self.money.get_money(user_id, guild_id)
-        total_earned = self.money.get_total_earned(user_id, guild_id)
-        total_lost = self.money.get_total_lost(user_id, guild_id)
-        highest_amount = self.money.get_max(user_id, guild_id)
+        (
+            current_cookies,
+            total_earned,
+            total_lost,
+            highest_amount,
+        ) = await self.money.get_stats(user_id, guild_id)
 
         if not current_cookies:
             await interaction.response.send_message(
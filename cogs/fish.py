@@ -1,85 +1,90 @@
+import math
 import random
-from typing import Dict, List, Optional, Tuple
+import time
+from collections import Counter
+from typing import Dict, List, Literal, Optional, Set, Tuple
 
 import discord
-import tomllib
 from discord import app_commands
 from discord.ext import commands
 
 from main import DiscordBot
 from models.fishing import (
+    Bait,
     Fish,
+    FishingInventory,
+    FishingLeaderboards,
     FishingSettings,
     FishingStats,
-    FishingStatsItems,
+    ItemCatalog,
     Rarity,
     Rod,
 )
+from utils.config import Settings
+from utils.leaderboard import Leaderboard, Leaderboards
 from utils.money import Money
 
+CAST_COOLDOWN = 5.0
+# Most casts a single /fish cast can make
+MAX_CASTS = 25
+
+# What each /fish leaderboard metric is counted in; levels are shown as "Level N"
+LEADERBOARD_UNITS: Dict[str, str] = {
+    "caught": "fish",
+    "weight": "pounds",
+    "value": "cookies",
+    "level": "",
+}
+
 
 @app_commands.guild_only()
 class Fishing(commands.GroupCog, group_name="fish"):
     def __init__(self, bot: DiscordBot) -> None:
         self.bot: DiscordBot = bot
-        self.money: Money = Money(bot.database)
-        self.settings: FishingSettings = self._load_settings()
-
-    def _load_settings(self) -> FishingSettings:
-        with open("config.toml", "rb") as f:
-            raw: Dict = tomllib.load(f)["fishing"]
-            return FishingSettings(**raw)
-
-    def _calculate_catch_chance(
-        self, user_stats: FishingStats, rod: Optional[Rod] = None
-    ) -> float:
-        catch_chance: float = self.settings.base_catch_chance * (
-            1 + (user_stats.level * self.settings.level_modifier)
+        self.money: Money = bot.money
+        self.settings: FishingSettings = bot.config.settings.fishing
+        self.catalog: ItemCatalog
+        self.leaderboards: FishingLeaderboards
+        # (guild_id, user_id) -> time.monotonic() at which they may cast again
+        self.cast_ready_at: Dict[Tuple[int, int], float] = {}
+
+    async def cog_load(self) -> None:
+        self.catalog = await ItemCatalog.sync(self.bot.database, self.settings)
+        self.leaderboards = FishingLeaderboards(
+            self.bot.database,
+            self.catalog,
+            [fish.name for fish in self.settings.fish],
         )
+        self.bot.config.subscribe(self.on_config_reload)
+        self.bot.rankings.append(self.leaderboards)
 
-        if rod:
-            catch_chance *= 1 + rod.modifier
-
-        return catch_chance
-
-    def _choose_fish(self) -> Tuple[Fish, Rarity]:
-        rarity: Rarity = random.choices(
-            self.settings.rarity,
-            weights=[rarity.probability for rarity in self.settings.rarity],
-        )[0]
+    async def cog_unload(self) -> None:
+        self.bot.config.unsubscribe(self.on_config_reload)
+        self.bot.rankings.remove(self.leaderboards)
 
-        fishes: List[Fish] = []
-        for fish in self.settings.fish:
-            if fish.rarity == rarity.name:
-                fishes.append(fish)
+    async def on_config_reload(self, settings: Settings) -> None:
+        # The settings arrive with their samplers compiled; only new items need IDs
+        catalog: ItemCatalog = await ItemCatalog.sync(
+            self.bot.database, settings.fishing
+        )
 
-        return (random.choice(fishes), rarity)
+        # Swapped together, with nothing awaited in between
+        self.settings = settings.fishing
+        self.catalog = catalog
+        self.leaderboards.set_species(
+            catalog, [fish.name for fish in settings.fishing.fish]
+        )
 
-    def _get_current_rod(self, user_id: int, guild_id: int) -> Rod:
+    def _get_current_rod(self, user_stats: FishingStats) -> Rod:
+        # Users start with, and fall back to, the first (default) rod
         for rod in self.settings.rod:
-            item: FishingStatsItems = FishingStatsItems(
-                user_id,
-                guild_id,
-                self.bot.database,
-                "rod",
-                rod.name,
-                "owned",
-            )
-
-            if item.value == 2:
+            if rod.name == user_stats.equipped_rod:
                 return rod
-
-        item: FishingStatsItems = FishingStatsItems(
-            user_id,
-            guild_id,
-            self.bot.database,
-            "rod",
-            self.settings.rod[0].name,
-            "owned",
-        )
-        item.value = 2
         return self.settings.rod[0]
 
+    def _get_owned_rods(self, inventory: FishingInventory) -> Set[str]:
+        return {self.settings.rod[0].name} | inventory.names("rod", "owned")
+
     @app_commands.command()
     async def rarity(self, interaction: discord.Interaction):
         """Shows the rarity types!"""
@@ -133,42 +138,47 @@ class Fishing(commands.GroupCog, group_name="fish"):
         user_id: int = interaction.user.id
         guild_id: int = interaction.guild.id
 
-        if select:
-            for rod in self.settings.rod:
-                item: FishingStatsItems = FishingStatsItems(
-                    user_id,
-                    guild_id,
-                    self.bot.database,
-                    "rod",
-                    rod.name,
-                    "owned",
-                )
-
-                if item.value == 2:
-                    item.value = 1
+        inventory: FishingInventory = await FishingInventory(
+            user_id, guild_id, self.bot.database, self.catalog
+        ).load()
+        owned: Set[str] = self._get_owned_rods(inventory)
 
+        if select:
             selected_rod: Rod = self.settings.rod[select - 1]
-            item: FishingStatsItems = FishingStatsItems(
-                user_id, guild_id, self.bot.database, "rod", selected_rod.name, "owned"
-            )
 
-            if item.value == 0:
-                if not self.money.lose(user_id, guild_id, selected_rod.price):
+            if selected_rod.name not in owned:
+                if not await self.money.lose(
+                    user_id, guild_id, selected_rod.price, "rod"
+                ):
                     return await interaction.response.send_message(
                         f"You don't have enough cookies to buy the {selected_rod.name}!"
                     )
-                else:
-                    item.value = 2
-                    return await interaction.response.send_message(
-                        f"You have purchased and equipped the {selected_rod.name} for {selected_rod.price} cookies!"
-                    )
+
+                inventory.set("rod", selected_rod.name, "owned", 1)
+                await inventory.save()
+
+            await self.bot.database.update_row(
+                user_id,
+                guild_id,
+                "fishing_stats_core",
+                {"equipped_rod": selected_rod.name},
+            )
+
+            if selected_rod.name not in owned:
+                return await interaction.response.send_message(
+                    f"You have purchased and equipped the {selected_rod.name} for {selected_rod.price} cookies!"
+                )
             else:
-                item.value = 2
                 return await interaction.response.send_message(
                     f"You have equipped the {selected_rod.name}!"
                 )
 
         else:
+            user_stats: FishingStats = await FishingStats(
+                user_id, guild_id, self.bot.database
+            ).load()
+            current_rod: Rod = self._get_current_rod(user_stats)
+
             embed: discord.Embed = discord.Embed(
                 title="Rods", color=discord.Color.blue()
             )
@@ -181,13 +191,9 @@ class Fishing(commands.GroupCog, group_name="fish"):
                 if i == 0:
                     field_name += " [Default]"
 
-                item: FishingStatsItems = FishingStatsItems(
-                    user_id, guild_id, self.bot.database, "rod", rod.name, "owned"
-                )
-
-                if item.value == 2:
+                if rod.name == current_rod.name:
                     field_name += " [Equipped]"
-                elif item.value == 1:
+                elif rod.name in owned:
                     field_name += " [Owned]"
 
                 embed.add_field(name=field_name, value=value, inline=False)
@@ -206,8 +212,10 @@ class Fishing(commands.GroupCog, group_name="fish"):
 
         user_id: int = member.id
         guild_id: int = interaction.guild.id
-        user_stats: FishingStats = FishingStats(user_id, guild_id, self.bot.database)
-        rod: Rod = self._get_current_rod(user_id, guild_id)
+        user_stats: FishingStats = await FishingStats(
+            user_id, guild_id, self.bot.database
+        ).load()
+        rod: Rod = self._get_current_rod(user_stats)
 
         embed: discord.Embed = discord.Embed(
             title=f"{member.display_name}'s Fishing Stats!",
@@ -233,106 +241,336 @@ class Fishing(commands.GroupCog, group_name="fish"):
         )
         embed.add_field(
             name="Catch Chance",
-            value=f"{self._calculate_catch_chance(user_stats, rod) * 100:.2f}%",
+            value=f"{self.settings.catch_chance(user_stats.level, rod) * 100:.2f}%",
         )
 
+        inventory: FishingInventory = await FishingInventory(
+            user_id, guild_id, self.bot.database, self.catalog
+        ).load()
         fish_stats: str = ""
         for fish in self.settings.fish:
-            fish_item: FishingStatsItems = FishingStatsItems(
-                user_id, guild_id, self.bot.database, "fish", fish.name, "caught"
-            )
-            fish_stats += f"{fish.name}: {fish_item.value}\n"
+            fish_stats += f"{fish.name}: {inventory.get('fish', fish.name, 'caught')}\n"
         embed.add_field(name="Fish Caught", value=fish_stats, inline=False)
 
         embed.add_field(name="Current Rod", value=rod.name, inline=False)
 
         await interaction.response.send_message(embed=embed)
 
-    @app_commands.command()
-    @app_commands.checks.cooldown(1, 5.0, key=lambda i: (i.guild_id, i.user.id))
-    async def cast(self, interaction: discord.Interaction) -> None:
-        """CAST! CAST! CAST!"""
-
-        if interaction.guild is None:
-            await interaction.response.send_message(
-                "This command can only be used in a server!", ephemeral=True
-            )
-            return
+    def _catch_embed(
+        self,
+        interaction: discord.Interaction,
+        user_stats: FishingStats,
+        catches: List[Tuple[Fish, Rarity]],
+        level_ups: int,
+    ) -> discord.Embed:
+        if not catches:
+            # Create failure embed message
+            return discord.Embed(title="Tough luck!", color=discord.Color.red())
 
-        user_id: int = interaction.user.id
-        guild_id: int = interaction.guild.id
-        user_stats: FishingStats = FishingStats(user_id, guild_id, self.bot.database)
+        fish, rarity = catches[0]
 
-        # Calculate catch chance
-        attempt: float = random.random()
-        attempt_successful: bool = attempt <= self._calculate_catch_chance(
-            user_stats, self._get_current_rod(user_id, guild_id)
+        # Create success embed message
+        embed: discord.Embed = discord.Embed(
+            title=f"{interaction.user.display_name} caught a fish!",
+            color=discord.Color.green(),
+        )
+        embed.add_field(name="Type", value=fish.name, inline=False)
+        embed.add_field(
+            name="Weight",
+            value=f"{fish.weight} pounds",
+            inline=False,
+        )
+        embed.add_field(
+            name="Price",
+            value=f"{rarity.price} cookies",
+            inline=False,
+        )
+        embed.add_field(
+            name="Rarity",
+            value=f"{rarity.name}",
+            inline=False,
         )
 
-        if attempt_successful:
-            # Choose random fish
-            fish: Tuple[Fish, Rarity] = self._choose_fish()
-
-            fish_stats: FishingStatsItems = FishingStatsItems(
-                user_id, guild_id, self.bot.database, "fish", fish[0].name, "caught"
+        if level_ups:
+            embed.add_field(
+                name="Status",
+                value=f"Leveled up! [{user_stats.level}]",
+                inline=False,
             )
 
-            # Update stats
-            user_stats.total_fish_caught += 1
-            user_stats.total_weight += fish[0].weight
-            user_stats.total_value += fish[1].price
-            user_stats.experience += 1
-            fish_stats.value += 1
-            self.money.earn(user_id, guild_id, fish[1].price)
+        return embed
 
-            # Create success embed message
-            embed: discord.Embed = discord.Embed(
-                title=f"{interaction.user.display_name} caught a fish!",
-                color=discord.Color.green(),
+    def _summary_embed(
+        self,
+        interaction: discord.Interaction,
+        user_stats: FishingStats,
+        catches: List[Tuple[Fish, Rarity]],
+        level_ups: int,
+        count: int,
+        bait: Optional[Bait],
+    ) -> discord.Embed:
+        embed: discord.Embed = discord.Embed(
+            title=f"{interaction.user.display_name} cast {count} times!",
+            color=discord.Color.green() if catches else discord.Color.red(),
+        )
+        embed.add_field(
+            name="Caught", value=f"{len(catches)}/{count} fish", inline=False
+        )
+
+        if catches:
+            caught: Counter[str] = Counter(fish.name for fish, _ in catches)
+            embed.add_field(
+                name="Fish",
+                value="\n".join(f"{name} x{amount}" for name, amount in caught.items()),
+                inline=False,
             )
-            embed.add_field(name="Type", value=fish[0].name, inline=False)
             embed.add_field(
                 name="Weight",
-                value=f"{fish[0].weight} pounds",
+                value=f"{sum(fish.weight for fish, _ in catches)} pounds",
                 inline=False,
             )
             embed.add_field(
                 name="Price",
-                value=f"{fish[1].price} cookies",
+                value=f"{sum(rarity.price for _, rarity in catches)} cookies",
                 inline=False,
             )
+
+        if bait is not None:
             embed.add_field(
-                name="Rarity",
-                value=f"{fish[1].name}",
+                name="Bait",
+                value=f"{count} {bait.name} for {bait.price * count} cookies",
                 inline=False,
             )
 
+        if level_ups:
+            embed.add_field(
+                name="Status",
+                value=f"Leveled up! [{user_stats.level}]",
+                inline=False,
+            )
+
+        return embed
+
+    @app_commands.command()
+    async def cast(
+        self,
+        interaction: discord.Interaction,
+        count: app_commands.Range[int, 1, MAX_CASTS] = 1,
+        bait: Optional[str] = None,
+    ) -> None:
+        """CAST! CAST! CAST! Bait costs one per cast, however many casts you make."""
+
+        if interaction.guild is None:
+            await interaction.response.send_message(
+                "This command can only be used in a server!", ephemeral=True
+            )
+            return
+
+        user_id: int = interaction.user.id
+        guild_id: int = interaction.guild.id
+        key: Tuple[int, int] = (guild_id, user_id)
+
+        wait: float = self.cast_ready_at.get(key, 0.0) - time.monotonic()
+        if wait > 0:
+            message = (
+                "You are still casting!"
+                if wait == math.inf
+                else f"You are on cooldown. Try again in {wait:.2f}s"
+            )
+            await interaction.response.send_message(message, ephemeral=True)
+            return
+
+        chosen_bait: Optional[Bait] = None
+        if bait is not None:
+            chosen_bait = next(
+                (option for option in self.settings.bait if option.name == bait), None
+            )
+            if chosen_bait is None:
+                await interaction.response.send_message(
+                    f"There is no bait called {bait}!", ephemeral=True
+                )
+                return
+
+        # Held while casting, so a second cast cannot start before this one
+        # commits. The cooldown only starts once the casts are saved.
+        self.cast_ready_at[key] = math.inf
+        result = None
+        try:
+            result = await self._cast(user_id, guild_id, count, chosen_bait)
+        finally:
+            if result is None:
+                del self.cast_ready_at[key]
+            else:
+                # A multi-cast waits out the cooldown of every cast it makes
+                self.cast_ready_at[key] = time.monotonic() + CAST_COOLDOWN * count
+
+        if result is None:
+            assert chosen_bait is not None
+            await interaction.response.send_message(
+                f"You need {chosen_bait.price * count} cookies for "
+                f"{count} {chosen_bait.name}!",
+                ephemeral=True,
+            )
+            return
+
+        user_stats, inventory, catches, level_ups = result
+        if catches:
+            self.leaderboards.record(
+                user_stats, inventory, {fish.name for fish, _ in catches}
+            )
+
+        if count == 1:
+            embed = self._catch_embed(interaction, user_stats, catches, level_ups)
+        else:
+            embed = self._summary_embed(
+                interaction, user_stats, catches, level_ups, count, chosen_bait
+            )
+
+        await interaction.response.send_message(embed=embed)
+
+    async def _cast(
+        self, user_id: int, guild_id: int, count: int, bait: Optional[Bait]
+    ) -> Optional[
+        Tuple[FishingStats, FishingInventory, List[Tuple[Fish, Rarity]], int]
+    ]:
+        """Makes and saves count casts, or returns None if the bait is unaffordable."""
+        bait_cost: int = bait.price * count if bait else 0
+
+        user_stats: FishingStats = await FishingStats(
+            user_id, guild_id, self.bot.database
+        ).load()
+        rod: Rod = self._get_current_rod(user_stats)
+        rarity_modifier: float = rod.rarity_modifier + (
+            bait.rarity_modifier if bait else 0.0
+        )
+
+        # Roll every cast up front; the catch chance still follows level-ups
+        attempts: List[float] = [random.random() for _ in range(count)]
+        catches: List[Tuple[Fish, Rarity]] = []
+        level_ups: int = 0
+
+        for attempt in attempts:
+            if attempt > self.settings.catch_chance(user_stats.level, rod, bait):
+                continue
+
+            # Choose random fish
+            fish, rarity = self.settings.choose_fish(rarity_modifier)
+            catches.append((fish, rarity))
+
+            # Update stats
+            user_stats.total_fish_caught += 1
+            user_stats.total_weight += fish.weight
+            user_stats.total_value += rarity.price
+            user_stats.experience += 1
+
             if user_stats.experience == self.settings.experience:
                 user_stats.level += 1
                 user_stats.experience = 0
-                embed.add_field(
-                    name="Status",
-                    value=f"Leveled up! [{user_stats.level}]",
-                    inline=False,
+                level_ups += 1
+
+        inventory: FishingInventory = await FishingInventory(
+            user_id, guild_id, self.bot.database, self.catalog
+        ).load()
+        for fish, _ in catches:
+            inventory.add("fish", fish.name, "caught", 1)
+
+        # The bait, the payout, the catches and the stats commit together, so a
+        # failure part way keeps none of them
+        async with self.money.transaction(user_id, guild_id) as conn:
+            if bait_cost and not await self.money.change(
+                conn, user_id, guild_id, -bait_cost, "bait"
+            ):
+                return None
+
+            if catches:
+                await self.money.change(
+                    conn,
+                    user_id,
+                    guild_id,
+                    sum(rarity.price for _, rarity in catches),
+                    "fish",
                 )
+            await inventory.save(conn)
+            await user_stats.save(conn)
+
+        return user_stats, inventory, catches, level_ups
+
+    @cast.autocomplete("bait")
+    async def bait_autocomplete(
+        self, interaction: discord.Interaction, current: str
+    ) -> List[app_commands.Choice[str]]:
+        return [
+            app_commands.Choice(
+                name=f"{bait.name} ({bait.price} cookies)", value=bait.name
+            )
+            for bait in self.settings.bait
+            if current.lower() in bait.name.lower()
+        ][:25]
 
-            await interaction.response.send_message(embed=embed)
+    @app_commands.command()
+    async def leaderboard(
+        self,
+        interaction: discord.Interaction,
+        metric: Literal["caught", "weight", "value", "level"] = "caught",
+        species: Optional[str] = None,
+    ):
+        """Shows the top fishers! Pick a species to see who caught the most of it."""
+
+        if interaction.guild is None:
+            await interaction.response.send_message(
+                "This command can only be used in a server!", ephemeral=True
+            )
+            return
+
+        if species is not None:
+            if species not in self.leaderboards.species:
+                await interaction.response.send_message(
+                    f"There is no fish called {species}!", ephemeral=True
+                )
+                return
+
+            leaderboards: Leaderboards = self.leaderboards.species[species]
+            title: str = f"Biggest {species} Catchers"
+            unit: str = "caught"
         else:
-            # Create failure embed message
-            embed: discord.Embed = discord.Embed(
-                title="Tough luck!", color=discord.Color.red()
+            leaderboards = self.leaderboards.metrics[metric]
+            title = f"Top Fishers by {metric.capitalize()}"
+            unit = LEADERBOARD_UNITS[metric]
+
+        board: Leaderboard = await leaderboards.get(interaction.guild.id)
+
+        embed: discord.Embed = discord.Embed(title=title, color=discord.Color.blue())
+
+        # Stream entries until ten of them are members this guild can resolve
+        rank: int = 0
+        for _, user_id, score in board.entries():
+            member: Optional[discord.Member] = interaction.guild.get_member(user_id)
+            if member is None or not score:
+                continue
+
+            rank += 1
+            embed.add_field(
+                name=f"#{rank} {member.display_name}",
+                value=f"{score:,} {unit}" if unit else f"Level {score}",
+                inline=False,
             )
+            if rank == 10:
+                break
 
-            await interaction.response.send_message(embed=embed)
+        if not rank:
+            embed.description = "No one has caught anything yet!"
 
-    @cast.error
-    async def on_cast_error(
-        self,
-        interaction: discord.Interaction,
-        error: app_commands.AppCommandError,
-    ) -> None:
-        if isinstance(error, app_commands.CommandOnCooldown):
-            await interaction.response.send_message(str(error), ephemeral=True)
+        await interaction.response.send_message(embed=embed)
+
+    @leaderboard.autocomplete("species")
+    async def species_autocomplete(
+        self, interaction: discord.Interaction, current: str
+    ) -> List[app_commands.Choice[str]]:
+        return [
+            app_commands.Choice(name=name, value=name)
+            for name in self.leaderboards.species
+            if current.lower() in name.lower()
+        ][:25]
 
 
 async def setup(bot: DiscordBot) -> None:
@@ -1,5 +1,4 @@
 import discord
-import tomllib
 from discord import app_commands
 from discord.ext import commands
 
@@ -8,17 +7,13 @@ class Moderation(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
 
-        with open("config.toml", "rb") as f:
-            self.config = tomllib.load(f)["moderation"]
-            self.blacklisted_words = self.config["blacklisted_words"]
-
     @commands.Cog.listener()
     async def on_message(self, message):
         if message.author == self.bot.user:
             return
 
-        content = message.content.lower()
-        if any(word in content for word in self.blacklisted_words):
+        # Read on every message, so reloaded settings apply straight away
+        if self.bot.config.settings.moderation.is_blacklisted(message.content):
             await message.delete()
             await message.channel.send(
                 f"{message.author.display_name}, that word is not allowed!"
@@ -3,14 +3,13 @@ from collections import deque
 from typing import Any, Dict, Optional, Union, cast
 
 import discord
-import tomllib
 import yt_dlp
 from discord import app_commands
 from discord.ext import commands
 
 import utils.tts
 from main import DiscordBot
-from utils.money import Money
+from utils.config import Settings
 from utils.voting import Voting
 
 # Suppress noise about console usage from errors
@@ -103,13 +102,24 @@ class Voice(commands.GroupCog):
         self.voice_queue: deque[YTDLSource] = deque()
         self.current_song: Optional[Union[YTDLSource, LocalFileSource]] = None
         self.skip_votes: Dict[int, Voting] = {}
-        self.money = Money(bot.database)
+        self.money = bot.money
+        self._apply_settings(bot.config.settings)
 
-        with open("config.toml", "rb") as f:
-            self.config = tomllib.load(f)["voice"]
-            self.play_cost = self.config["play_cost"]
-            self.tts_cost = self.config["tts_cost"]
+    async def cog_load(self) -> None:
+        self.bot.config.subscribe(self.on_config_reload)
 
+    async def cog_unload(self) -> None:
+        self.bot.config.unsubscribe(self.on_config_reload)
+
+    async def on_config_reload(self, settings: Settings) -> None:
+        self._apply_settings(settings)
+
+    def _apply_settings(self, settings: Settings) -> None:
+        self.play_cost = settings.voice.play_cost
+        self.tts_cost = settings.voice.tts_cost
+        self.voices = settings.tts.voices
+
+        # New descriptions show up in Discord after the next command sync
         play_desc = "Plays from a url or search query!"
         if self.play_cost > 0:
             play_desc += f" (Costs {self.play_cost} cookies)"
@@ -183,11 +193,11 @@ class Voice(commands.GroupCog):
             return
 
         if self.play_cost > 0:
-            user_balance = self.money.get_money(
+            user_balance = await self.money.get_money(
                 interaction.user.id, interaction.guild.id
             )
-            if not self.money.lose(
-                interaction.user.id, interaction.guild.id, self.play_cost
+            if not await self.money.lose(
+                interaction.user.id, interaction.guild.id, self.play_cost, "play"
             ):
                 await interaction.response.send_message(
                     f"You need {self.play_cost} cookies to use this command! You only have {user_balance}!",
@@ -498,16 +508,16 @@ class Voice(commands.GroupCog):
 
         if message == "":
             await interaction.response.send_message(
-                f"Current voices: {utils.tts.get_voices()}"
+                f"Current voices: {utils.tts.get_voices(self.voices)}"
             )
             return
 
         if self.tts_cost > 0:
-            user_balance = self.money.get_money(
+            user_balance = await self.money.get_money(
                 interaction.user.id, interaction.guild.id
             )
-            if not self.money.lose(
-                interaction.user.id, interaction.guild.id, self.tts_cost
+            if not await self.money.lose(
+                interaction.user.id, interaction.guild.id, self.tts_cost, "tts"
             ):
                 await interaction.response.send_message(
                     f"You need {self.tts_cost} cookies to use this command! You only have {user_balance}!",
@@ -524,7 +534,7 @@ class Voice(commands.GroupCog):
         await interaction.response.defer()
 
         try:
-            urls = await utils.tts.generate_tts(message)
+            urls = await utils.tts.generate_tts(message, self.voices)
 
             if urls is None:
                 await interaction.followup.send(
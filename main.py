@@ -10,7 +10,11 @@ from aiohttp import ClientSession
 from discord.ext import commands
 from dotenv import load_dotenv
 
+from utils.config import Config
 from utils.database import Database
+from utils.leaderboard import MemberRankings
+from utils.money import Money
+from utils.scheduler import Scheduler
 
 
 class DiscordBot(commands.Bot):
@@ -24,12 +28,23 @@ class DiscordBot(commands.Bot):
         **kwargs,
     ):
         super().__init__(*args, **kwargs)
+        # Parsed once here; cogs read config.settings and subscribe to reloads
+        self.config = Config("config.toml")
         self.database = database
+        # Shared so every cog sees the same balance cache and per-user locks
+        self.money = Money(database)
+        # Told about members leaving and rejoining; cogs add their own rankings
+        self.rankings: List[MemberRankings] = [self.money.leaderboards]
+        # Reverses mutes and other timed effects, including ones from before a restart
+        self.scheduler = Scheduler(self, database)
         self.web_client = web_client
         self.testing_guild_id = testing_guild_id
         self.initial_extensions = initial_extensions
 
     async def setup_hook(self) -> None:
+        await self.config.start()
+        await self.scheduler.start()
+
         for extension in self.initial_extensions:
             await self.load_extension(f"cogs.{extension}")
 
@@ -38,6 +53,34 @@ class DiscordBot(commands.Bot):
             self.tree.copy_global_to(guild=guild)
             await self.tree.sync(guild=guild)
 
+    async def on_guild_available(self, guild: discord.Guild) -> None:
+        # Members who left or rejoined while the bot was offline sent no events
+        if not self.intents.members:
+            return
+        if not guild.chunked:
+            await guild.chunk()
+
+        member_ids = {member.id for member in guild.members}
+        if await self.database.reconcile_departed(guild.id, member_ids):
+            for rankings in self.rankings:
+                rankings.invalidate(guild.id)
+
+    async def on_member_remove(self, member: discord.Member) -> None:
+        await self.database.set_departed(member.id, member.guild.id, True)
+        for rankings in self.rankings:
+            rankings.depart(member.guild.id, member.id)
+
+    async def on_member_join(self, member: discord.Member) -> None:
+        # Most joins are new members, with no departure to clear
+        if await self.database.set_departed(member.id, member.guild.id, False):
+            for rankings in self.rankings:
+                await rankings.rejoin(member.guild.id, member.id)
+
+    async def close(self) -> None:
+        await self.config.stop()
+        await self.scheduler.stop()
+        await super().close()
+
 
 async def main():
     logger = logging.getLogger("discord")
@@ -67,7 +110,7 @@ async def main():
     guild_id = os.environ["GUILD_ID"]
 
     async with ClientSession() as our_client:
-        with Database("data/users.db") as db:
+        async with Database("data/users.db") as db:
             exts = ["casino", "cookies", "fish", "moderation", "voice"]
             intents = discord.Intents.default()
             intents.message_content = True
@@ -1,26 +1,41 @@
-from typing import List
+import logging
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple, Type
 
-from pydantic import BaseModel
+import aiosqlite
+from pydantic import BaseModel, Field, PrivateAttr, model_validator
 
-from utils.database import Database
+from utils.database import COLUMNS, Database
+from utils.leaderboard import Leaderboards
+from utils.sampling import AliasTable
+
+logger = logging.getLogger(__name__)
 
 
 class Fish(BaseModel):
     name: str
     weight: int
     rarity: str
+    # Relative odds of this fish among the fish of its rarity
+    frequency: float = Field(default=1.0, gt=0)
+    # Earlier names, so a renamed fish keeps its stats
+    previous_names: List[str] = []
 
 
 class Rod(BaseModel):
     name: str
     price: int
     modifier: float
+    # Multiplies each rarity's odds by (1 + rarity_modifier) per step of rareness
+    rarity_modifier: float = Field(default=0.0, gt=-1)
+    previous_names: List[str] = []
 
 
 class Bait(BaseModel):
     name: str
     price: int
     modifier: float
+    rarity_modifier: float = Field(default=0.0, gt=-1)
+    previous_names: List[str] = []
 
 
 class Rarity(BaseModel):
@@ -38,141 +53,475 @@ class FishingSettings(BaseModel):
     bait: List[Bait]
     rarity: List[Rarity]
 
+    # Samplers compiled once from the lists above
+    _rarity_weights: List[float] = PrivateAttr()
+    _rarity_table: AliasTable = PrivateAttr()
+    _fish_tables: List[Tuple[List[Fish], Optional[AliasTable]]] = PrivateAttr()
+    # How many steps rarer than the most common rarity each rarity is
+    _rareness: List[int] = PrivateAttr()
+    _acceptance: Dict[float, List[float]] = PrivateAttr(default_factory=dict)
+
+    @model_validator(mode="after")
+    def check_rarity_modifiers(self) -> "FishingSettings":
+        # A rod and bait's modifiers add up, and at -1 or below no rarer fish
+        # could ever be accepted
+        lowest = min((rod.rarity_modifier for rod in self.rod), default=0.0) + min(
+            (bait.rarity_modifier for bait in self.bait if bait.rarity_modifier < 0),
+            default=0.0,
+        )
+        if lowest <= -1:
+            raise ValueError("A rod and bait's rarity_modifier must add up to over -1")
+        return self
+
+    def model_post_init(self, __context: Any) -> None:
+        fishes: Dict[str, List[Fish]] = {rarity.name: [] for rarity in self.rarity}
+        for fish in self.fish:
+            if fish.rarity in fishes:
+                fishes[fish.rarity].append(fish)
+
+        self._fish_tables = [
+            (
+                fishes[rarity.name],
+                (
+                    AliasTable([fish.frequency for fish in fishes[rarity.name]])
+                    if fishes[rarity.name]
+                    else None
+                ),
+            )
+            for rarity in self.rarity
+        ]
+        # A rarity without any fish can never be rolled
+        self._rarity_weights = [
+            rarity.probability if fishes[rarity.name] else 0.0 for rarity in self.rarity
+        ]
+        self._rarity_table = AliasTable(self._rarity_weights)
+
+        by_odds = sorted(
+            range(len(self.rarity)), key=lambda i: -self.rarity[i].probability
+        )
+        self._rareness = [0] * len(self.rarity)
+        for step, index in enumerate(by_odds):
+            self._rareness[index] = step
+
+    def catch_chance(
+        self, level: int, rod: Optional[Rod] = None, bait: Optional[Bait] = None
+    ) -> float:
+        catch_chance: float = self.base_catch_chance * (
+            1 + (level * self.level_modifier)
+        )
+
+        if rod:
+            catch_chance *= 1 + rod.modifier
+        if bait:
+            catch_chance *= 1 + bait.modifier
+
+        return catch_chance
+
+    def rarity_odds(self, rarity_modifier: float = 0.0) -> List[float]:
+        """Returns the exact chance of rolling each rarity, as choose_fish() does."""
+        weights = [
+            probability * acceptance
+            for probability, acceptance in zip(
+                self._rarity_weights, self._rarity_acceptance(rarity_modifier)
+            )
+        ]
+        total = sum(weights)
+        return [weight / total for weight in weights]
+
+    def _rarity_acceptance(self, rarity_modifier: float) -> List[float]:
+        acceptance = self._acceptance.get(rarity_modifier)
+        if acceptance is None:
+            boosts = [(1 + rarity_modifier) ** step for step in self._rareness]
+            highest = max(boosts)
+            acceptance = self._acceptance[rarity_modifier] = [
+                boost / highest for boost in boosts
+            ]
+        return acceptance
+
+    def choose_fish(self, rarity_modifier: float = 0.0) -> Tuple[Fish, Rarity]:
+        """Rolls a rarity, then a fish of that rarity, in O(1) each.
+
+        A rarity_modifier skews the roll towards rarer fish (or away, if negative)
+        by rejection sampling, so the tables never need rebuilding.
+        """
+        if rarity_modifier:
+            index = self._rarity_table.sample_accepting(
+                self._rarity_acceptance(rarity_modifier)
+            )
+        else:
+            index = self._rarity_table.sample()
+
+        fishes, table = self._fish_tables[index]
+        assert table is not None
+        return fishes[table.sample()], self.rarity[index]
+
 
 class FishingStats:
+    """A user's fishing_stats_core row, read once and written back on exit.
+
+    async with FishingStats(user_id, guild_id, database) as stats:
+        stats.total_fish_caught += 1
+    """
+
+    FIELDS: Tuple[str, ...] = COLUMNS["fishing_stats_core"]
+    # Every other field is a counter that starts at 0
+    DEFAULTS: Dict[str, Any] = {"equipped_rod": None}
+
     def __init__(self, user_id: int, guild_id: int, database: Database):
         self.user_id: int = user_id
         self.guild_id: int = guild_id
         self.database: Database = database
 
-    @property
-    def total_fish_caught(self) -> int:
-        return self.database.get_value(
-            self.user_id, self.guild_id, "fishing_stats_core", "total_fish_caught"
-        )[0]
-
-    @total_fish_caught.setter
-    def total_fish_caught(self, value) -> None:
-        self.database.set_value(
-            self.user_id,
-            self.guild_id,
-            "fishing_stats_core",
-            "total_fish_caught",
-            value,
-        )
+        self.values: Dict[str, Any] = {}
+        # Fields assigned since the row was loaded
+        self.dirty: Set[str] = set()
 
-    @property
-    def total_weight(self) -> int:
-        return self.database.get_value(
-            self.user_id, self.guild_id, "fishing_stats_core", "total_weight"
-        )[0]
+    def __getattr__(self, name: str) -> Any:
+        # Only called for attributes not found normally, i.e. the row's fields
+        if name in type(self).FIELDS:
+            try:
+                return self.__dict__["values"][name]
+            except KeyError:
+                raise AttributeError(f"{name} has not been loaded") from None
+        raise AttributeError(name)
 
-    @total_weight.setter
-    def total_weight(self, value) -> None:
-        self.database.set_value(
-            self.user_id, self.guild_id, "fishing_stats_core", "total_weight", value
+    def __setattr__(self, name: str, value) -> None:
+        if name in type(self).FIELDS:
+            self.values[name] = value
+            self.dirty.add(name)
+        else:
+            super().__setattr__(name, value)
+
+    async def load(self) -> "FishingStats":
+        row = await self.database.get_row(
+            self.user_id, self.guild_id, "fishing_stats_core", self.FIELDS
         )
+        self.values = {
+            field: self.DEFAULTS.get(field, 0) if value is None else value
+            for field, value in zip(self.FIELDS, row)
+        }
+        self.dirty.clear()
+        return self
 
-    @property
-    def total_value(self) -> int:
-        return self.database.get_value(
-            self.user_id, self.guild_id, "fishing_stats_core", "total_value"
-        )[0]
+    async def save(self, conn: Optional[aiosqlite.Connection] = None) -> None:
+        """Queues every changed field as a single row update.
 
-    @total_value.setter
-    def total_value(self, value) -> None:
-        self.database.set_value(
-            self.user_id, self.guild_id, "fishing_stats_core", "total_value", value
-        )
+        Given the connection of a Database.flushing_transaction(), the update is
+        written in that transaction instead.
+        """
+        if not self.dirty:
+            return
 
-    @property
-    def level(self) -> int:
-        return self.database.get_value(
-            self.user_id, self.guild_id, "fishing_stats_core", "level"
-        )[0]
+        values = {field: self.values[field] for field in self.dirty}
+        if conn is None:
+            await self.database.update_row(
+                self.user_id, self.guild_id, "fishing_stats_core", values
+            )
+        else:
+            await self.database.write_row(
+                conn, self.user_id, self.guild_id, "fishing_stats_core", values
+            )
+        self.dirty.clear()
 
-    @level.setter
-    def level(self, value) -> None:
-        self.database.set_value(
-            self.user_id, self.guild_id, "fishing_stats_core", "level", value
-        )
+    async def __aenter__(self) -> "FishingStats":
+        return await self.load()
 
-    @property
-    def experience(self) -> int:
-        return self.database.get_value(
-            self.user_id, self.guild_id, "fishing_stats_core", "experience"
-        )[0]
+    async def __aexit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc: Optional[BaseException],
+        exc_tb: Optional[type],
+    ) -> None:
+        # A command that failed part way keeps none of its changes
+        if exc_type is None:
+            await self.save()
 
-    @experience.setter
-    def experience(self, value) -> None:
-        self.database.set_value(
-            self.user_id, self.guild_id, "fishing_stats_core", "experience", value
-        )
 
+# Every stat kept in fishing_stats_items
+STAT_TYPES: Tuple[str, ...] = ("caught", "owned")
+
+
+class ItemCatalog:
+    """Integer IDs for fishing items and stat types, which fishing_stats_items is keyed by."""
 
-class FishingStatsItems:
     def __init__(
         self,
-        user_id: int,
-        guild_id: int,
-        database: Database,
-        item_type: str,
-        item_name: str,
-        stat_type: str,
+        items: Iterable[Tuple[int, str, str]],
+        stats: Iterable[Tuple[int, str]],
     ):
-        self.user_id: int = user_id
-        self.guild_id: int = guild_id
-        self.database: Database = database
+        self.item_ids: Dict[Tuple[str, str], int] = {}
+        self.items: Dict[int, Tuple[str, str]] = {}
+        for item_id, item_type, item_name in items:
+            self.item_ids[item_type, item_name] = item_id
+            self.items[item_id] = (item_type, item_name)
+
+        self.stat_ids: Dict[str, int] = {}
+        self.stats: Dict[int, str] = {}
+        for stat_id, name in stats:
+            self.stat_ids[name] = stat_id
+            self.stats[stat_id] = name
 
-        self.item_type: str = item_type
-        self.item_name: str = item_name
-        self.stat_type: str = stat_type
+    @classmethod
+    async def sync(cls, database: Database, settings: FishingSettings) -> "ItemCatalog":
+        """Adds every item in the settings to the catalog and loads all of it."""
+        items: List[Tuple[str, Fish | Rod | Bait]] = [
+            *(("fish", fish) for fish in settings.fish),
+            *(("rod", rod) for rod in settings.rod),
+            *(("bait", bait) for bait in settings.bait),
+        ]
 
-        with self.database.conn:
-            self.database.cursor.execute(
+        # Flushing first, so no queued equipped_rod can undo a rename below
+        async with database.flushing_transaction() as conn:
+            # A renamed item keeps the ID, and so the stats, of its old name
+            for item_type, item in items:
+                for previous_name in item.previous_names:
+                    await cls._rename(conn, item_type, previous_name, item.name)
+
+            await conn.executemany(
                 """
-                INSERT OR IGNORE INTO fishing_stats_items (user_id, guild_id, item_type, item_name, stat_type)
-                VALUES (?, ?, ?, ?, ?);
+                INSERT OR IGNORE INTO fishing_items (item_type, item_name) VALUES (?, ?);
                 """,
-                (
-                    self.user_id,
-                    self.guild_id,
-                    self.item_type,
-                    self.item_name,
-                    self.stat_type,
-                ),
+                [(item_type, item.name) for item_type, item in items],
+            )
+            await conn.executemany(
+                """
+                INSERT OR IGNORE INTO fishing_stat_types (name) VALUES (?);
+                """,
+                [(name,) for name in STAT_TYPES],
             )
 
-    @property
-    def value(self) -> int:
-        with self.database.conn:
-            self.database.cursor.execute(
+            catalog_items = await conn.execute_fetchall(
+                """
+                SELECT id, item_type, item_name FROM fishing_items;
                 """
-                SELECT value FROM fishing_stats_items WHERE user_id = ? AND guild_id = ? AND item_type = ? AND item_name = ? AND stat_type = ?;
+            )
+            catalog_stats = await conn.execute_fetchall(
+                """
+                SELECT id, name FROM fishing_stat_types;
+                """
+            )
+
+        return cls(catalog_items, catalog_stats)
+
+    @staticmethod
+    async def _rename(
+        conn: aiosqlite.Connection, item_type: str, old_name: str, new_name: str
+    ) -> None:
+        cursor = await conn.execute(
+            """
+            UPDATE OR IGNORE fishing_items SET item_name = ?
+            WHERE item_type = ? AND item_name = ?;
+            """,
+            (new_name, item_type, old_name),
+        )
+        if not cursor.rowcount:
+            # Ignored when both names are already in the catalog, e.g. when
+            # previous_names was added after the new name had been used
+            rows = await conn.execute_fetchall(
+                """
+                SELECT 1 FROM fishing_items WHERE item_type = ? AND item_name = ?;
                 """,
-                (
-                    self.user_id,
-                    self.guild_id,
-                    self.item_type,
-                    self.item_name,
-                    self.stat_type,
-                ),
+                (item_type, old_name),
             )
-        return self.database.cursor.fetchone()[0]
+            if rows:
+                logger.warning(
+                    "Cannot rename %s %r to %r, which already has its own stats; "
+                    "stats recorded under %r are not carried over",
+                    item_type,
+                    old_name,
+                    new_name,
+                    old_name,
+                )
+                return
 
-    @value.setter
-    def value(self, value) -> None:
-        with self.database.conn:
-            self.database.cursor.execute(
+        if item_type == "rod":
+            # The equipped rod is stored by name; this also catches rows queued
+            # under the old name after an earlier sync renamed the rod
+            await conn.execute(
                 """
-                UPDATE fishing_stats_items SET value = ? WHERE user_id = ? AND guild_id = ? AND item_type = ? AND item_name = ? AND stat_type = ?;
+                UPDATE fishing_stats_core SET equipped_rod = ? WHERE equipped_rod = ?;
                 """,
-                (
-                    value,
-                    self.user_id,
-                    self.guild_id,
-                    self.item_type,
-                    self.item_name,
-                    self.stat_type,
-                ),
+                (new_name, old_name),
             )
+
+    def key(self, item_type: str, item_name: str, stat_type: str) -> Tuple[int, int]:
+        """Returns the (item_id, stat_id) that fishing_stats_items rows are keyed by."""
+        return self.item_ids[item_type, item_name], self.stat_ids[stat_type]
+
+
+# (item_type, item_name, stat_type)
+ItemKey = Tuple[str, str, str]
+
+
+class FishingInventory:
+    """All of a user's fishing_stats_items rows, read in one query.
+
+    Missing rows read as 0 and are only created once they are written.
+
+    async with FishingInventory(user_id, guild_id, database, catalog) as inventory:
+        inventory.add("fish", "Salmon", "caught", 1)
+    """
+
+    def __init__(
+        self, user_id: int, guild_id: int, database: Database, catalog: ItemCatalog
+    ):
+        self.user_id: int = user_id
+        self.guild_id: int = guild_id
+        self.database: Database = database
+        self.catalog: ItemCatalog = catalog
+
+        self.values: Dict[ItemKey, int] = {}
+        # Entries set since the inventory was loaded
+        self.dirty: Set[ItemKey] = set()
+
+    async def load(self) -> "FishingInventory":
+        rows = await self.database.fetchall(
+            """
+            SELECT item_id, stat_id, value FROM fishing_stats_items
+            WHERE user_id = ? AND guild_id = ?;
+            """,
+            (self.user_id, self.guild_id),
+        )
+        items, stats = self.catalog.items, self.catalog.stats
+        self.values = {
+            (*items[item_id], stats[stat_id]): value for item_id, stat_id, value in rows
+        }
+        self.dirty.clear()
+        return self
+
+    def get(self, item_type: str, item_name: str, stat_type: str) -> int:
+        return self.values.get((item_type, item_name, stat_type), 0)
+
+    def set(self, item_type: str, item_name: str, stat_type: str, value: int) -> None:
+        key = (item_type, item_name, stat_type)
+        if self.values.get(key, 0) == value:
+            return
+        self.values[key] = value
+        self.dirty.add(key)
+
+    def add(self, item_type: str, item_name: str, stat_type: str, amount: int) -> None:
+        self.set(
+            item_type,
+            item_name,
+            stat_type,
+            self.get(item_type, item_name, stat_type) + amount,
+        )
+
+    def names(self, item_type: str, stat_type: str) -> Set[str]:
+        """Returns the names of items of a type whose stat is non-zero."""
+        return {
+            item_name
+            for (type_, item_name, stat), value in self.values.items()
+            if type_ == item_type and stat == stat_type and value
+        }
+
+    async def save(self, conn: Optional[aiosqlite.Connection] = None) -> None:
+        """Upserts every changed entry in one transaction, or in the caller's conn."""
+        if not self.dirty:
+            return
+
+        if conn is None:
+            await self.database.ensure_user(self.user_id, self.guild_id)
+            async with self.database.transaction() as conn:
+                await self._upsert(conn)
+        else:
+            await self._upsert(conn)
+        self.dirty.clear()
+
+    async def _upsert(self, conn: aiosqlite.Connection) -> None:
+        await conn.executemany(
+            """
+            INSERT INTO fishing_stats_items (user_id, guild_id, item_id, stat_id, value)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (user_id, guild_id, item_id, stat_id)
+            DO UPDATE SET value = excluded.value;
+            """,
+            [
+                (self.user_id, self.guild_id, *self.catalog.key(*key), self.values[key])
+                for key in self.dirty
+            ],
+        )
+
+    async def __aenter__(self) -> "FishingInventory":
+        return await self.load()
+
+    async def __aexit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc: Optional[BaseException],
+        exc_tb: Optional[type],
+    ) -> None:
+        if exc_type is None:
+            await self.save()
+
+
+# /fish leaderboard metric -> the fishing_stats_core column it ranks
+FISHING_METRICS: Dict[str, str] = {
+    "caught": "total_fish_caught",
+    "weight": "total_weight",
+    "value": "total_value",
+    "level": "level",
+}
+
+
+class FishingLeaderboards:
+    """Rankings for every fishing metric and for catches of every species."""
+
+    def __init__(
+        self, database: Database, catalog: ItemCatalog, species: Iterable[str]
+    ):
+        self.database: Database = database
+        self.metrics: Dict[str, Leaderboards] = {
+            metric: Leaderboards(database, "fishing_stats_core", column)
+            for metric, column in FISHING_METRICS.items()
+        }
+        self.species: Dict[str, Leaderboards] = {}
+        self.set_species(catalog, species)
+
+    def set_species(self, catalog: ItemCatalog, species: Iterable[str]) -> None:
+        """Ranks exactly these species, keeping the boards already seeded for them."""
+        self.species = {
+            name: self.species.get(name)
+            or Leaderboards(
+                self.database,
+                "fishing_stats_items",
+                "value",
+                "AND item_id = ? AND stat_id = ?",
+                catalog.key("fish", name, "caught"),
+            )
+            for name in species
+        }
+
+    def all(self) -> Iterator[Leaderboards]:
+        yield from self.metrics.values()
+        yield from self.species.values()
+
+    def record(
+        self,
+        user_stats: FishingStats,
+        inventory: Optional[FishingInventory] = None,
+        species: Iterable[str] = (),
+    ) -> None:
+        """Updates the rankings with a user's saved stats and their catch counts of species."""
+        guild_id, user_id = user_stats.guild_id, user_stats.user_id
+        for metric, column in FISHING_METRICS.items():
+            self.metrics[metric].update(guild_id, user_id, user_stats.values[column])
+
+        if inventory is not None:
+            for name in species:
+                if name in self.species:
+                    self.species[name].update(
+                        guild_id, user_id, inventory.get("fish", name, "caught")
+                    )
+
+    def depart(self, guild_id: int, user_id: int) -> None:
+        for leaderboards in self.all():
+            leaderboards.depart(guild_id, user_id)
+
+    def invalidate(self, guild_id: int) -> None:
+        for leaderboards in self.all():
+            leaderboards.invalidate(guild_id)
+
+    async def rejoin(self, guild_id: int, user_id: int) -> None:
+        for leaderboards in list(self.all()):
+            await leaderboards.rejoin(guild_id, user_id)
@@ -1,102 +1,158 @@
 import random
-from typing import List
-
-
-class Card:
-    def __init__(self, rank, suit):
-        self.rank: str = rank
-        self.suit: str = suit
-
-    def __repr__(self):
-        return f"{self.rank} of {self.suit}"
-
-
-class Deck:
-    def __init__(self):
-        suits: List[str] = ["Hearts", "Diamonds", "Clubs", "Spades"]
-        ranks: List[str] = [
-            "2",
-            "3",
-            "4",
-            "5",
-            "6",
-            "7",
-            "8",
-            "9",
-            "10",
-            "Jack",
-            "Queen",
-            "King",
-            "Ace",
-        ]
-        self.cards: List[Card] = [Card(rank, suit) for suit in suits for rank in ranks]
-        random.shuffle(self.cards)
-
-    def deal_card(self) -> Card:
-        if not self.cards:
-            raise ValueError("Deck is empty!")
-        return self.cards.pop()
+from typing import Iterator, List, Optional
+
+# A card is an int from 0 to 51: suit * 13 + rank
+RANKS = (
+    "2",
+    "3",
+    "4",
+    "5",
+    "6",
+    "7",
+    "8",
+    "9",
+    "10",
+    "Jack",
+    "Queen",
+    "King",
+    "Ace",
+)
+SUITS = ("Hearts", "Diamonds", "Clubs", "Spades")
+DECK_SIZE = len(RANKS) * len(SUITS)
+
+# Card -> its value, counting aces as 11
+VALUES = bytes((2, 3, 4, 5, 6, 7, 8, 9, 10, 10, 10, 10, 11) * len(SUITS))
+ACE = 11
+
+
+def card_name(card: int) -> str:
+    suit, rank = divmod(card, len(RANKS))
+    return f"{RANKS[rank]} of {SUITS[suit]}"
+
+
+class Hand:
+    """Cards held by one side, with the best total kept up to date as cards are added."""
+
+    __slots__ = ("cards", "total", "soft_aces")
+
+    def __init__(self) -> None:
+        self.cards: List[int] = []
+        self.total = 0
+        # Aces still counted as 11, each of which can drop to 1 to avoid a bust
+        self.soft_aces = 0
+
+    def __len__(self) -> int:
+        return len(self.cards)
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self.cards)
+
+    def add(self, card: int) -> None:
+        self.cards.append(card)
+        value = VALUES[card]
+        self.total += value
+        if value == ACE:
+            self.soft_aces += 1
+        while self.total > 21 and self.soft_aces:
+            self.total -= 10
+            self.soft_aces -= 1
+
+    @property
+    def is_blackjack(self) -> bool:
+        return self.total == 21 and len(self.cards) == 2
+
+    @property
+    def is_bust(self) -> bool:
+        return self.total > 21
+
+
+class Shoe:
+    """Several shuffled decks dealt in order, reshuffled once play passes the cut card.
+
+    penetration is the share of the shoe dealt before reshuffling. The shoe is
+    only reshuffled between games, so games sharing it see a real shoe's odds.
+    """
+
+    __slots__ = ("cards", "position", "cut", "rng")
+
+    def __init__(
+        self,
+        decks: int = 6,
+        penetration: float = 0.75,
+        rng: Optional[random.Random] = None,
+    ) -> None:
+        if decks < 1:
+            raise ValueError("A shoe needs at least one deck")
+        if not 0 < penetration <= 1:
+            raise ValueError("Penetration must be in (0, 1]")
+
+        self.cards = bytearray(range(DECK_SIZE)) * decks
+        self.cut = max(int(len(self.cards) * penetration), 1)
+        self.rng = rng or random
+        self.position = 0
+        self.shuffle()
+
+    def __len__(self) -> int:
+        """Returns how many cards are left to deal."""
+        return len(self.cards) - self.position
+
+    def shuffle(self) -> None:
+        self.rng.shuffle(self.cards)
+        self.position = 0
+
+    def start_game(self) -> None:
+        if self.position >= self.cut:
+            self.shuffle()
+
+    def deal(self) -> int:
+        # Only reached mid-game when concurrent games run a small shoe dry
+        if self.position == len(self.cards):
+            self.shuffle()
+
+        card = self.cards[self.position]
+        self.position += 1
+        return card
 
 
 class Blackjack:
-    def __init__(self, player_bet):
-        self.deck = Deck()
-        self.dealer_hand: List[Card] = []
-        self.player_hand: List[Card] = []
+    def __init__(self, player_bet: int, shoe: Optional[Shoe] = None):
+        self.shoe = shoe if shoe is not None else Shoe(decks=1)
+        self.shoe.start_game()
+        self.dealer_hand = Hand()
+        self.player_hand = Hand()
         self.player_bet = player_bet
 
-    def get_table(self) -> tuple[List[Card], List[Card]]:
+    def get_table(self) -> tuple[Hand, Hand]:
         return self.dealer_hand, self.player_hand
 
-    def calculate_hand(self, hand: List[Card]) -> int:
-        total: int = 0
+    def initial_deal(self) -> None:
+        self.dealer_hand.add(self.shoe.deal())
+        self.dealer_hand.add(self.shoe.deal())
+        self.player_hand.add(self.shoe.deal())
+        self.player_hand.add(self.shoe.deal())
 
-        for card in hand:
-            if card.rank in ["Jack", "Queen", "King"]:
-                rank: int = 10
-            elif card.rank == "Ace":
-                if (total + 11) <= 21:
-                    rank = 11
-                else:
-                    rank = 1
-            else:
-                rank = int(card.rank)
-
-            total = total + rank
-
-        return total
-
-    def initial_deal(self):
-        self.dealer_hand.append(self.deck.deal_card())
-        self.dealer_hand.append(self.deck.deal_card())
-        self.player_hand.append(self.deck.deal_card())
-        self.player_hand.append(self.deck.deal_card())
-
-    def hit(self, hand: List[Card]) -> bool:
-        hand.append(self.deck.deal_card())
-
-        if self.calculate_hand(self.player_hand) > 21:
-            return False
-        else:
-            return True
+    def hit(self) -> bool:
+        """Deals the player a card, returning False if they bust."""
+        self.player_hand.add(self.shoe.deal())
+        return not self.player_hand.is_bust
 
     def stand(self) -> tuple[str, int]:
-        while self.calculate_hand(self.dealer_hand) < 17:
-            self.dealer_hand.append(self.deck.deal_card())
-
-        player_total: int = self.calculate_hand(self.player_hand)
-        dealer_total: int = self.calculate_hand(self.dealer_hand)
-
-        player_blackjack = player_total == 21 and len(self.player_hand) == 2
-        dealer_blackjack = dealer_total == 21 and len(self.dealer_hand) == 2
+        player_blackjack = self.player_hand.is_blackjack
+        dealer_blackjack = self.dealer_hand.is_blackjack
 
         if player_blackjack and dealer_blackjack:
             return "Push", self.player_bet
         elif player_blackjack:
-            return "Blackjack", self.player_bet * 2.5
+            return "Blackjack", self.player_bet * 5 // 2
         elif dealer_blackjack:
             return "Tough luck! Dealer has natural blackjack!", 0
 
+        while self.dealer_hand.total < 17:
+            self.dealer_hand.add(self.shoe.deal())
+
+        player_total = self.player_hand.total
+        dealer_total = self.dealer_hand.total
+
         if dealer_total > 21 or player_total > dealer_total:
             return "Win", self.player_bet * 2
         elif player_total == dealer_total:
@@ -0,0 +1,143 @@
+import asyncio
+import logging
+import re
+import tomllib
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from pydantic import BaseModel, Field, PrivateAttr
+
+from models.fishing import FishingSettings
+
+logger = logging.getLogger(__name__)
+
+# Called with the new settings after every successful reload
+ConfigListener = Callable[["Settings"], Awaitable[None]]
+
+
+class CasinoSettings(BaseModel):
+    # Decks in each guild's blackjack shoe, and the share dealt before reshuffling
+    blackjack_decks: int = Field(default=6, ge=1)
+    blackjack_penetration: float = Field(default=0.75, gt=0, le=1)
+
+
+class ModerationSettings(BaseModel):
+    blacklisted_words: List[str] = []
+
+    # One case-insensitive pattern matching any blacklisted word
+    _matcher: Optional[re.Pattern] = PrivateAttr(default=None)
+
+    def model_post_init(self, __context) -> None:
+        words = [word for word in self.blacklisted_words if word]
+        if words:
+            self._matcher = re.compile(
+                "|".join(re.escape(word) for word in words), re.IGNORECASE
+            )
+
+    def is_blacklisted(self, content: str) -> bool:
+        return self._matcher is not None and self._matcher.search(content) is not None
+
+
+class TTSSettings(BaseModel):
+    # Speaker name -> TTS Monster voice ID
+    voice: Dict[str, str] = {}
+
+    # The same map with lowercased names, as speakers are matched in messages
+    _voices: Dict[str, str] = PrivateAttr(default_factory=dict)
+
+    def model_post_init(self, __context) -> None:
+        self._voices = {name.lower(): voice_id for name, voice_id in self.voice.items()}
+
+    @property
+    def voices(self) -> Dict[str, str]:
+        return self._voices
+
+
+class VoiceSettings(BaseModel):
+    play_cost: int = 0
+    tts_cost: int = 0
+
+
+class Settings(BaseModel):
+    fishing: FishingSettings
+    casino: CasinoSettings = CasinoSettings()
+    moderation: ModerationSettings = ModerationSettings()
+    tts: TTSSettings = TTSSettings()
+    voice: VoiceSettings = VoiceSettings()
+
+
+def load_settings(path: str | Path) -> Settings:
+    with open(path, "rb") as f:
+        return Settings(**tomllib.load(f))
+
+
+class Config:
+    """The bot's settings from config.toml, reloaded whenever the file changes.
+
+    A changed file is parsed and validated in full before it replaces the current
+    settings, so readers of config.settings never see a partial update and a bad
+    edit leaves the old settings in place.
+    """
+
+    def __init__(self, path: str | Path = "config.toml", interval: float = 2.0):
+        self.path = Path(path)
+        self.interval = interval
+        self.version = self._version()
+        self.settings: Settings = load_settings(self.path)
+
+        self.listeners: List[ConfigListener] = []
+        self.task: Optional[asyncio.Task] = None
+
+    def _version(self) -> Optional[Tuple[int, int]]:
+        try:
+            stat = self.path.stat()
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def subscribe(self, listener: ConfigListener) -> None:
+        self.listeners.append(listener)
+
+    def unsubscribe(self, listener: ConfigListener) -> None:
+        if listener in self.listeners:
+            self.listeners.remove(listener)
+
+    async def start(self) -> None:
+        self.task = asyncio.create_task(self._watch())
+
+    async def stop(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    async def _watch(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            version = self._version()
+            if version is None or version == self.version:
+                continue
+
+            self.version = version
+            await self.reload()
+
+    async def reload(self) -> bool:
+        """Swaps in the settings from the file, returning False if they are invalid."""
+        try:
+            settings = await asyncio.to_thread(load_settings, self.path)
+        except Exception:
+            logger.exception("Keeping the current settings; %s is invalid", self.path)
+            return False
+
+        self.settings = settings
+        logger.info("Reloaded settings from %s", self.path)
+
+        for listener in list(self.listeners):
+            try:
+                await listener(settings)
+            except Exception:
+                logger.exception("Failed to apply reloaded settings")
+        return True
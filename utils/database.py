@@ -1,27 +1,279 @@
-import sqlite3
-from typing import Optional, Type
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import (
+    Any,
+    AsyncIterator,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    Type,
+)
+
+import aiosqlite
+
+from utils.migrations import MIGRATIONS
+
+logger = logging.getLogger(__name__)
+
+# Applied to every connection; the writer additionally switches to WAL so
+# readers never block it (and it never blocks them)
+PRAGMAS: Tuple[str, ...] = (
+    "PRAGMA cache_size = -16000",  # 16 MiB page cache
+    "PRAGMA mmap_size = 268435456",  # 256 MiB memory-mapped I/O
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA busy_timeout = 5000",
+)
+WRITER_PRAGMAS: Tuple[str, ...] = (
+    "PRAGMA journal_mode = WAL",
+    # With WAL, NORMAL only fsyncs at checkpoints and stays corruption-safe
+    "PRAGMA synchronous = NORMAL",
+)
+
+# (table, user_id, guild_id) -> {column: value}
+PendingWrites = Dict[Tuple[str, int, int], Dict[str, Any]]
+
+# Per-user tables and the columns that may be read or written by name
+COLUMNS: Dict[str, Tuple[str, ...]] = {
+    "cookies": ("cookies", "total_earned", "total_lost", "max"),
+    "fishing_stats_core": (
+        "total_fish_caught",
+        "total_weight",
+        "total_value",
+        "level",
+        "experience",
+        "equipped_rod",
+    ),
+}
+
+# Tables that may be read by name but never written through the queue. Money
+# is the only writer of balances, as it keeps them cached and ranked.
+READ_ONLY: Set[str] = {"cookies"}
+
+
+def check_ids(user_id: int, guild_id: int) -> None:
+    """Rejects anything but plain ints, so every lookup hits the INTEGER keys."""
+    if type(user_id) is not int or type(guild_id) is not int:
+        raise TypeError(
+            f"user_id and guild_id must be int, got {type(user_id).__name__} "
+            f"and {type(guild_id).__name__}"
+        )
+
+
+class KnownUsers:
+    """Bounded LRU set of (user_id, guild_id) pairs that already have rows."""
+
+    def __init__(self, max_size: int) -> None:
+        self.max_size = max_size
+        # Both IDs are 64-bit snowflakes, so pack each pair into one int key
+        self.keys: OrderedDict[int, None] = OrderedDict()
+
+    @staticmethod
+    def _pack(user_id: int, guild_id: int) -> int:
+        return (user_id << 64) | guild_id
+
+    def __contains__(self, item: Tuple[int, int]) -> bool:
+        key = self._pack(*item)
+        if key not in self.keys:
+            return False
+
+        self.keys.move_to_end(key)
+        return True
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def add(self, user_id: int, guild_id: int) -> None:
+        key = self._pack(user_id, guild_id)
+        self.keys[key] = None
+        self.keys.move_to_end(key)
+
+        if len(self.keys) > self.max_size:
+            self.keys.popitem(last=False)
 
 
 class Database:
-    def __init__(self, file: str) -> None:
-        self.conn = sqlite3.connect(file)
-        self.cursor = self.conn.cursor()
-        self.create_tables()
+    def __init__(
+        self,
+        file: str,
+        flush_interval: float = 0.05,
+        flush_size: int = 256,
+        known_users_size: int = 50_000,
+        readers: int = 4,
+    ) -> None:
+        self.file = file
+        # Single writer connection; every INSERT/UPDATE goes through it
+        self.conn: aiosqlite.Connection
+        # aiosqlite runs every query on its own thread, but a single connection
+        # can still only hold one transaction at a time
+        self.lock = asyncio.Lock()
+
+        # Pool of read-only connections used by fetchone()/fetchall()
+        self.reader_count = readers
+        self.readers: asyncio.Queue[aiosqlite.Connection] = asyncio.Queue()
 
-    def __enter__(self):
+        # Write-behind queue: set_value() only records the new value here and
+        # flush() commits everything in one transaction, either flush_interval
+        # seconds after the first queued write or once flush_size writes queue up
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.pending: PendingWrites = {}
+        self.pending_count = 0
+        # Writes taken off the queue by a flush that has not committed yet
+        self.flushing: PendingWrites = {}
+        self.pending_event = asyncio.Event()
+        self.flush_lock = asyncio.Lock()
+        self.flush_task: Optional[asyncio.Task] = None
+
+        # Users already known to exist, so lookups can skip the users query
+        self.known_users = KnownUsers(known_users_size)
+
+    async def __aenter__(self):
+        await self.connect()
         return self
 
-    def __exit__(
+    async def __aexit__(
         self,
         exc_type: Optional[Type[BaseException]],
         exc: Optional[BaseException],
         exc_tb: Optional[type],
     ) -> None:
-        self.conn.close()
+        await self.close()
+
+    async def connect(self) -> None:
+        self.conn = await aiosqlite.connect(self.file)
+        for pragma in WRITER_PRAGMAS + PRAGMAS:
+            await self.conn.execute(pragma)
+        await self.create_tables()
 
-    def create_tables(self):
-        with self.conn:
-            self.cursor.execute(
+        # Readers are opened after the schema exists, since mode=ro cannot create it
+        uri = f"{Path(self.file).resolve().as_uri()}?mode=ro"
+        for _ in range(self.reader_count):
+            reader = await aiosqlite.connect(uri, uri=True)
+            for pragma in PRAGMAS:
+                await reader.execute(pragma)
+            self.readers.put_nowait(reader)
+
+        self.flush_task = asyncio.create_task(self._flush_loop())
+
+    async def close(self) -> None:
+        if self.flush_task is not None:
+            self.flush_task.cancel()
+            try:
+                await self.flush_task
+            except asyncio.CancelledError:
+                pass
+            self.flush_task = None
+
+        await self.flush()
+
+        while not self.readers.empty():
+            await self.readers.get_nowait().close()
+        await self.conn.close()
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await self.pending_event.wait()
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Failed to flush pending writes")
+
+    async def flush(self) -> None:
+        """Commits every queued write in a single transaction."""
+        async with self.flush_lock:
+            if self.pending:
+                async with self._flush_transaction():
+                    pass
+
+    @asynccontextmanager
+    async def flushing_transaction(self) -> AsyncIterator[aiosqlite.Connection]:
+        """A transaction that commits every queued write along with the caller's.
+
+        Queued values are written first, so the caller may overwrite any of them
+        with write_row() and no later flush can put an older value back.
+        """
+        async with self.flush_lock:
+            async with self._flush_transaction() as conn:
+                yield conn
+
+    @asynccontextmanager
+    async def _flush_transaction(self) -> AsyncIterator[aiosqlite.Connection]:
+        self.flushing, self.pending = self.pending, {}
+        self.pending_count = 0
+        self.pending_event.clear()
+
+        # Group rows that touch the same columns so each group is one executemany
+        statements: Dict[Tuple[str, Tuple[str, ...]], List[tuple]] = {}
+        for (table, user_id, guild_id), values in self.flushing.items():
+            columns = tuple(values)
+            statements.setdefault((table, columns), []).append(
+                (*values.values(), user_id, guild_id)
+            )
+
+        try:
+            async with self.transaction() as conn:
+                for (table, columns), rows in statements.items():
+                    assignments = ", ".join(f"{column} = ?" for column in columns)
+                    await conn.executemany(
+                        f"""
+                        UPDATE {table} SET {assignments} WHERE user_id = ? AND guild_id = ?
+                        """,
+                        rows,
+                    )
+                yield conn
+        except BaseException:
+            # Requeue the failed batch underneath anything written since
+            for key, values in self.flushing.items():
+                self.pending[key] = {**values, **self.pending.get(key, {})}
+            self.pending_count = len(self.pending)
+            if self.pending:
+                self.pending_event.set()
+            raise
+        finally:
+            self.flushing = {}
+
+    @asynccontextmanager
+    async def transaction(self) -> AsyncIterator[aiosqlite.Connection]:
+        async with self.lock:
+            try:
+                yield self.conn
+            except BaseException:
+                await self.conn.rollback()
+                raise
+            else:
+                await self.conn.commit()
+
+    @asynccontextmanager
+    async def reader(self) -> AsyncIterator[aiosqlite.Connection]:
+        """Borrows a read-only connection from the pool."""
+        conn = await self.readers.get()
+        try:
+            yield conn
+        finally:
+            self.readers.put_nowait(conn)
+
+    async def fetchone(self, query: str, parameters: tuple = ()) -> Optional[tuple]:
+        async with self.reader() as conn:
+            async with conn.execute(query, parameters) as cursor:
+                return await cursor.fetchone()
+
+    async def fetchall(self, query: str, parameters: tuple = ()) -> list:
+        async with self.reader() as conn:
+            async with conn.execute(query, parameters) as cursor:
+                return list(await cursor.fetchall())
+
+    async def create_tables(self):
+        async with self.transaction() as conn:
+            await conn.execute(
                 """
                 CREATE TABLE IF NOT EXISTS users (
                     user_id INTEGER NOT NULL,
@@ -30,7 +282,7 @@ class Database:
                 );
                 """
             )
-            self.cursor.execute(
+            await conn.execute(
                 """
                 CREATE TABLE IF NOT EXISTS fishing_stats_core (
                     user_id INTEGER NOT NULL,
@@ -44,7 +296,7 @@ class Database:
                 );
                 """
             )
-            self.cursor.execute(
+            await conn.execute(
                 """
                 CREATE TABLE IF NOT EXISTS fishing_stats_items (
                     user_id INTEGER NOT NULL,
@@ -58,7 +310,7 @@ class Database:
                 );
                 """
             )
-            self.cursor.execute(
+            await conn.execute(
                 """
                 CREATE TABLE IF NOT EXISTS cookies (
                     user_id INTEGER,
@@ -72,53 +324,235 @@ class Database:
                 """
             )
 
-    def create_user(self, user_id: int, guild_id: int):
-        with self.conn:
-            self.cursor.execute(
+        await self.migrate()
+
+    async def migrate(self) -> None:
+        """Brings an existing database up to the latest schema version."""
+        row = await self.conn.execute_fetchall("PRAGMA user_version;")
+        version: int = list(row)[0][0]
+
+        for number, statements in enumerate(MIGRATIONS[version:], start=version + 1):
+            logger.info("Applying database migration %d", number)
+            async with self.transaction() as conn:
+                await conn.execute("BEGIN IMMEDIATE;")
+                for statement in statements:
+                    await conn.execute(statement)
+                await conn.execute(f"PRAGMA user_version = {number};")
+
+    async def create_user(self, user_id: int, guild_id: int):
+        await self.create_users([(user_id, guild_id)])
+
+    async def create_users(self, users: Sequence[Tuple[int, int]]) -> None:
+        for user_id, guild_id in users:
+            check_ids(user_id, guild_id)
+
+        async with self.transaction() as conn:
+            await conn.executemany(
                 """
                 INSERT OR IGNORE INTO users (user_id, guild_id)
                 VALUES (?, ?);
                 """,
-                (user_id, guild_id),
+                users,
             )
-            self.cursor.execute(
+            await conn.executemany(
                 """
                 INSERT OR IGNORE INTO fishing_stats_core (user_id, guild_id)
                 VALUES (?, ?);
                 """,
-                (user_id, guild_id),
+                users,
             )
-            self.cursor.execute(
+            await conn.executemany(
                 """
                 INSERT OR IGNORE INTO cookies (user_id, guild_id)
                 VALUES (?, ?);
                 """,
-                (user_id, guild_id),
+                users,
             )
 
-    def user_exists(self, user_id: int, guild_id: int) -> bool:
-        self.cursor.execute(
+        for user_id, guild_id in users:
+            self.known_users.add(user_id, guild_id)
+
+    async def user_exists(self, user_id: int, guild_id: int) -> bool:
+        check_ids(user_id, guild_id)
+        row = await self.fetchone(
             """
             SELECT 1 FROM users WHERE user_id = ? AND guild_id = ?;
             """,
             (user_id, guild_id),
         )
-        return self.cursor.fetchone() is not None
+        return row is not None
 
-    def get_value(self, user_id: int, guild_id: int, table: str, column: str):
-        if not self.user_exists(user_id, guild_id):
-            self.create_user(user_id, guild_id)
+    async def ensure_user(self, user_id: int, guild_id: int) -> None:
+        check_ids(user_id, guild_id)
+        if (user_id, guild_id) in self.known_users:
+            return
 
-        with self.conn:
-            self.cursor.execute(
+        if await self.user_exists(user_id, guild_id):
+            self.known_users.add(user_id, guild_id)
+        else:
+            await self.create_user(user_id, guild_id)
+
+    async def ensure_users(self, users: Iterable[Tuple[int, int]]) -> None:
+        """Bulk ensure_user(): creates rows for every unknown user in one transaction."""
+        unknown = list(
+            dict.fromkeys(user for user in users if user not in self.known_users)
+        )
+        if unknown:
+            # INSERT OR IGNORE makes this safe for users that exist but were evicted
+            await self.create_users(unknown)
+
+    async def set_departed(self, user_id: int, guild_id: int, departed: bool) -> bool:
+        """Records whether a member has left the guild, for the leaderboards to skip.
+
+        Returns False, writing nothing, for a member who joins without having left.
+        """
+        check_ids(user_id, guild_id)
+        if not departed:
+            row = await self.fetchone(
+                """
+                SELECT 1 FROM departed_members WHERE guild_id = ? AND user_id = ?;
+                """,
+                (guild_id, user_id),
+            )
+            if row is None:
+                return False
+
+        async with self.transaction() as conn:
+            if departed:
+                await conn.execute(
+                    """
+                    INSERT OR REPLACE INTO departed_members (guild_id, user_id, left_at)
+                    VALUES (?, ?, ?);
+                    """,
+                    (guild_id, user_id, int(time.time())),
+                )
+            else:
+                await conn.execute(
+                    """
+                    DELETE FROM departed_members WHERE guild_id = ? AND user_id = ?;
+                    """,
+                    (guild_id, user_id),
+                )
+        return True
+
+    async def reconcile_departed(self, guild_id: int, member_ids: Set[int]) -> bool:
+        """Brings departed_members in line with a guild's full member list.
+
+        Covers members who left or came back while the bot was not listening.
+        Returns whether anything changed.
+        """
+        users = await self.fetchall(
+            """
+            SELECT user_id FROM users WHERE guild_id = ?;
+            """,
+            (guild_id,),
+        )
+        departed = await self.fetchall(
+            """
+            SELECT user_id FROM departed_members WHERE guild_id = ?;
+            """,
+            (guild_id,),
+        )
+        departed_ids = {user_id for (user_id,) in departed}
+        left = {user_id for (user_id,) in users} - member_ids - departed_ids
+        returned = departed_ids & member_ids
+        if not left and not returned:
+            return False
+
+        now = int(time.time())
+        async with self.transaction() as conn:
+            await conn.executemany(
+                """
+                INSERT OR IGNORE INTO departed_members (guild_id, user_id, left_at)
+                VALUES (?, ?, ?);
+                """,
+                [(guild_id, user_id, now) for user_id in left],
+            )
+            await conn.executemany(
+                """
+                DELETE FROM departed_members WHERE guild_id = ? AND user_id = ?;
+                """,
+                [(guild_id, user_id) for user_id in returned],
+            )
+        return True
+
+    @staticmethod
+    def _check_columns(table: str, columns: Iterable[str], write: bool = False) -> None:
+        if table not in COLUMNS:
+            raise ValueError(f"Unknown table: {table}")
+        if write and table in READ_ONLY:
+            raise ValueError(f"{table} cannot be written by name")
+
+        for column in columns:
+            if column not in COLUMNS[table]:
+                raise ValueError(f"Unknown column for {table}: {column}")
+
+    async def get_row(
+        self, user_id: int, guild_id: int, table: str, columns: Sequence[str]
+    ) -> tuple:
+        """Reads several columns of a user's row in one query, in column order."""
+        check_ids(user_id, guild_id)
+        self._check_columns(table, columns)
+
+        key = (table, user_id, guild_id)
+        queued: Dict[str, Any] = {
+            **self.flushing.get(key, {}),
+            **self.pending.get(key, {}),
+        }
+        missing = [column for column in columns if column not in queued]
+
+        if missing:
+            await self.ensure_user(user_id, guild_id)
+            row = await self.fetchone(
                 f"""
-                SELECT {column} FROM {table} WHERE user_id = ? AND guild_id = ?;
+                SELECT {", ".join(missing)} FROM {table} WHERE user_id = ? AND guild_id = ?;
                 """,
                 (user_id, guild_id),
             )
-        return self.cursor.fetchone()
+            if row is not None:
+                queued = {**dict(zip(missing, row)), **queued}
+
+        return tuple(queued.get(column) for column in columns)
+
+    async def update_row(
+        self, user_id: int, guild_id: int, table: str, values: Dict[str, Any]
+    ) -> None:
+        """Queues new values for several columns of a user's row at once."""
+        check_ids(user_id, guild_id)
+        self._check_columns(table, values, write=True)
+        await self.ensure_user(user_id, guild_id)
+
+        self.pending.setdefault((table, user_id, guild_id), {}).update(values)
+        self.pending_count += len(values)
+        self.pending_event.set()
+
+        if self.pending_count >= self.flush_size:
+            await self.flush()
+
+    async def write_row(
+        self,
+        conn: aiosqlite.Connection,
+        user_id: int,
+        guild_id: int,
+        table: str,
+        values: Dict[str, Any],
+    ) -> None:
+        """Updates several columns of a user's row in the caller's flushing_transaction()."""
+        check_ids(user_id, guild_id)
+        self._check_columns(table, values, write=True)
+
+        assignments = ", ".join(f"{column} = ?" for column in values)
+        await conn.execute(
+            f"""
+            UPDATE {table} SET {assignments} WHERE user_id = ? AND guild_id = ?;
+            """,
+            (*values.values(), user_id, guild_id),
+        )
+
+    async def get_value(self, user_id: int, guild_id: int, table: str, column: str):
+        return await self.get_row(user_id, guild_id, table, (column,))
 
-    def set_value(
+    async def set_value(
         self,
         user_id: int,
         guild_id: int,
@@ -126,13 +560,4 @@ class Database:
         column: str,
         value: str | int,
     ):
-        if not self.user_exists(user_id, guild_id):
-            self.create_user(user_id, guild_id)
-
-        with self.conn:
-            self.cursor.execute(
-                f"""
-                UPDATE {table} SET {column} = ? WHERE user_id = ? AND guild_id = ?
-                """,
-                (value, user_id, guild_id),
-            )
+        await self.update_row(user_id, guild_id, table, {column: value})
@@ -0,0 +1,342 @@
+import asyncio
+import random
+from typing import (
+    Any,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Protocol,
+    Set,
+    Tuple,
+)
+
+from utils.database import Database
+
+MAX_LEVELS = 24  # Plenty for 2**24 entries per guild
+
+
+class _Node:
+    __slots__ = ("key", "next", "width")
+
+    def __init__(self, key: Any, levels: int) -> None:
+        self.key = key
+        self.next: List[_Node] = [NIL] * levels if levels else []
+        # width[i] is how many positions next[i] is ahead of this node
+        self.width: List[int] = [1] * levels
+
+
+NIL = _Node(None, 0)
+
+
+class IndexableSkipList:
+    """Sorted collection of unique keys with O(log n) insert, remove, rank and lookup by position."""
+
+    def __init__(self) -> None:
+        self.head = _Node(None, MAX_LEVELS)
+        self.size = 0
+
+    @classmethod
+    def from_sorted(cls, keys: Iterable[Any]) -> "IndexableSkipList":
+        """Builds the list in O(n) from keys that are already in ascending order."""
+        skiplist = cls()
+        last: List[_Node] = [skiplist.head] * MAX_LEVELS
+        last_position = [0] * MAX_LEVELS
+
+        position = 0
+        for key in keys:
+            position += 1
+            node = _Node(key, cls._random_levels())
+            for level in range(len(node.next)):
+                last[level].next[level] = node
+                last[level].width[level] = position - last_position[level]
+                last[level] = node
+                last_position[level] = position
+
+        # Every level finally links to NIL, one past the last position
+        for level in range(MAX_LEVELS):
+            last[level].width[level] = position + 1 - last_position[level]
+
+        skiplist.size = position
+        return skiplist
+
+    @staticmethod
+    def _random_levels() -> int:
+        # Geometric with p = 1/2: one more than the number of trailing zero bits
+        bits = random.getrandbits(MAX_LEVELS - 1)
+        return (bits & -bits).bit_length() if bits else MAX_LEVELS
+
+    def __len__(self) -> int:
+        return self.size
+
+    def insert(self, key: Any) -> None:
+        chain: List[_Node] = [self.head] * MAX_LEVELS
+        steps_at_level = [0] * MAX_LEVELS
+        node = self.head
+        for level in reversed(range(MAX_LEVELS)):
+            while node.next[level] is not NIL and node.next[level].key < key:
+                steps_at_level[level] += node.width[level]
+                node = node.next[level]
+            chain[level] = node
+
+        new = _Node(key, self._random_levels())
+        steps = 0
+        for level in range(len(new.next)):
+            previous = chain[level]
+            new.next[level] = previous.next[level]
+            previous.next[level] = new
+            new.width[level] = previous.width[level] - steps
+            previous.width[level] = steps + 1
+            steps += steps_at_level[level]
+
+        for level in range(len(new.next), MAX_LEVELS):
+            chain[level].width[level] += 1
+
+        self.size += 1
+
+    def remove(self, key: Any) -> None:
+        chain: List[_Node] = [self.head] * MAX_LEVELS
+        node = self.head
+        for level in reversed(range(MAX_LEVELS)):
+            while node.next[level] is not NIL and node.next[level].key < key:
+                node = node.next[level]
+            chain[level] = node
+
+        target = chain[0].next[0]
+        if target is NIL or target.key != key:
+            raise KeyError(key)
+
+        for level in range(len(target.next)):
+            previous = chain[level]
+            previous.width[level] += target.width[level] - 1
+            previous.next[level] = target.next[level]
+
+        for level in range(len(target.next), MAX_LEVELS):
+            chain[level].width[level] -= 1
+
+        self.size -= 1
+
+    def rank(self, key: Any) -> int:
+        """Returns how many keys sort before key."""
+        position = 0
+        node = self.head
+        for level in reversed(range(MAX_LEVELS)):
+            while node.next[level] is not NIL and node.next[level].key < key:
+                position += node.width[level]
+                node = node.next[level]
+        return position
+
+    def _node_at(self, index: int) -> _Node:
+        remaining = index + 1
+        node = self.head
+        for level in reversed(range(MAX_LEVELS)):
+            while node.width[level] <= remaining:
+                remaining -= node.width[level]
+                node = node.next[level]
+        return node
+
+    def __getitem__(self, index: int) -> Any:
+        if not 0 <= index < self.size:
+            raise IndexError(index)
+        return self._node_at(index).key
+
+    def islice(self, start: int, stop: int) -> Iterator[Any]:
+        """Yields the keys at positions start through stop - 1."""
+        start = max(start, 0)
+        stop = min(stop, self.size)
+        if start >= stop:
+            return
+
+        node = self._node_at(start)
+        for _ in range(stop - start):
+            yield node.key
+            node = node.next[0]
+
+
+class Leaderboard:
+    """Scores of one guild, kept in ranking order."""
+
+    def __init__(self, scores: Optional[Dict[int, int]] = None) -> None:
+        self.scores: Dict[int, int] = scores or {}
+        # Keys sort by highest balance first, then by user ID
+        self.index = IndexableSkipList.from_sorted(
+            sorted((-score, user_id) for user_id, score in self.scores.items())
+        )
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def update(self, user_id: int, score: int) -> None:
+        previous = self.scores.get(user_id)
+        if previous == score:
+            return
+
+        if previous is not None:
+            self.index.remove((-previous, user_id))
+        self.scores[user_id] = score
+        self.index.insert((-score, user_id))
+
+    def remove(self, user_id: int) -> None:
+        score = self.scores.pop(user_id, None)
+        if score is not None:
+            self.index.remove((-score, user_id))
+
+    def rank(self, user_id: int) -> Optional[int]:
+        """Returns a user's 0-based position, or None if they are not ranked."""
+        score = self.scores.get(user_id)
+        if score is None:
+            return None
+        return self.index.rank((-score, user_id))
+
+    def top(self, limit: int, offset: int = 0) -> List[Tuple[int, int]]:
+        """Returns (user_id, score) pairs for positions offset to offset + limit."""
+        return [
+            (user_id, -negative_score)
+            for negative_score, user_id in self.index.islice(offset, offset + limit)
+        ]
+
+    def entries(self, offset: int = 0) -> Iterator[Tuple[int, int, int]]:
+        """Lazily yields (position, user_id, score) from offset to the end of the board."""
+        keys = self.index.islice(offset, len(self.index))
+        for position, (negative_score, user_id) in enumerate(keys, start=offset):
+            yield position, user_id, -negative_score
+
+
+class Leaderboards:
+    """Lazily seeded per-guild rankings of one column, updated in place by its writers.
+
+    where may narrow the rows with extra conditions, whose placeholders are
+    filled from parameters.
+    """
+
+    def __init__(
+        self,
+        db: Database,
+        table: str,
+        score: str,
+        where: str = "",
+        parameters: Tuple[Any, ...] = (),
+    ) -> None:
+        self.db = db
+        # Members who left are skipped here rather than after fetching
+        self.query = f"""
+            SELECT user_id, {score} FROM {table}
+            WHERE guild_id = ? {where} AND NOT EXISTS (
+                SELECT 1 FROM departed_members
+                WHERE departed_members.guild_id = {table}.guild_id
+                AND departed_members.user_id = {table}.user_id
+            );
+        """
+        self.score_query = f"""
+            SELECT {score} FROM {table} WHERE guild_id = ? AND user_id = ? {where};
+        """
+        self.parameters = parameters
+
+        self.boards: Dict[int, Leaderboard] = {}
+        # Scores written while a guild is being seeded, applied over the snapshot
+        self.loading: Dict[int, Dict[int, int]] = {}
+        self.generations: Dict[int, int] = {}
+        self.locks: Dict[int, asyncio.Lock] = {}
+        # Members who left each seeded guild; their score changes are not ranked
+        self.departed: Dict[int, Set[int]] = {}
+
+    def update(self, guild_id: int, user_id: int, score: int) -> None:
+        if user_id in self.departed.get(guild_id, ()):
+            return
+
+        if guild_id in self.loading:
+            self.loading[guild_id][user_id] = score
+
+        board = self.boards.get(guild_id)
+        if board is not None:
+            board.update(user_id, score)
+
+    def invalidate(self, guild_id: int) -> None:
+        """Drops a guild's board; it is reseeded from the database on next use."""
+        self.boards.pop(guild_id, None)
+        self.departed.pop(guild_id, None)
+        self.generations[guild_id] = self.generations.get(guild_id, 0) + 1
+
+    def depart(self, guild_id: int, user_id: int) -> None:
+        """Takes a member who left the guild off its board."""
+        if guild_id in self.loading:
+            self.invalidate(guild_id)
+
+        board = self.boards.get(guild_id)
+        if board is not None:
+            board.remove(user_id)
+            self.departed[guild_id].add(user_id)
+
+    async def rejoin(self, guild_id: int, user_id: int) -> None:
+        """Ranks a member who came back to the guild by their current score."""
+        if guild_id in self.loading:
+            # The snapshot being seeded may still count them as departed
+            self.invalidate(guild_id)
+            return
+
+        departed = self.departed.get(guild_id)
+        if departed is None or user_id not in departed:
+            return
+
+        # Read with the queue flushed and the writer held, so no score change
+        # can land between the read and the update
+        async with self.db.flushing_transaction() as conn:
+            async with conn.execute(
+                self.score_query, (guild_id, user_id, *self.parameters)
+            ) as cursor:
+                row = await cursor.fetchone()
+
+            board = self.boards.get(guild_id)
+            if board is not None and user_id in departed:
+                departed.discard(user_id)
+                if row is not None and row[0] is not None:
+                    board.update(user_id, row[0])
+
+    async def get(self, guild_id: int) -> Leaderboard:
+        board = self.boards.get(guild_id)
+        if board is not None:
+            return board
+
+        async with self.locks.setdefault(guild_id, asyncio.Lock()):
+            board = self.boards.get(guild_id)
+            if board is not None:
+                return board
+
+            generation = self.generations.get(guild_id, 0)
+            self.loading[guild_id] = {}
+            try:
+                # Queued writes from before seeding started would not be in the snapshot
+                await self.db.flush()
+                departed = await self.db.fetchall(
+                    """
+                    SELECT user_id FROM departed_members WHERE guild_id = ?;
+                    """,
+                    (guild_id,),
+                )
+                rows = await self.db.fetchall(self.query, (guild_id, *self.parameters))
+            finally:
+                written = self.loading.pop(guild_id)
+
+            departed_ids = {user_id for (user_id,) in departed}
+            board = Leaderboard({user_id: score for user_id, score in rows})
+            for user_id, score in written.items():
+                if user_id not in departed_ids:
+                    board.update(user_id, score)
+
+            # A failed or bulk write, or a member leaving or joining, during
+            # seeding leaves the snapshot untrusted
+            if generation == self.generations.get(guild_id, 0):
+                self.boards[guild_id] = board
+                self.departed[guild_id] = departed_ids
+            return board
+
+
+class MemberRankings(Protocol):
+    """Anything ranking members, told by the bot when they leave or rejoin a guild."""
+
+    def depart(self, guild_id: int, user_id: int) -> None: ...
+
+    def invalidate(self, guild_id: int) -> None: ...
+
+    async def rejoin(self, guild_id: int, user_id: int) -> None: ...
@@ -0,0 +1,288 @@
+from typing import List, Tuple
+
+# Schema migrations, applied in order by Database.create_tables().
+#
+# The database's PRAGMA user_version records how many of these have run, so
+# each entry must stay append-only: never edit or reorder a migration that has
+# shipped, add a new one instead. Every migration runs in its own transaction.
+MIGRATIONS: List[Tuple[str, ...]] = [
+    # 1: Primary keys on the per-user tables and indexes for the leaderboards
+    (
+        """
+        CREATE TABLE cookies_new (
+            user_id INTEGER NOT NULL,
+            guild_id INTEGER NOT NULL,
+            cookies INTEGER DEFAULT 0,
+            total_earned INTEGER DEFAULT 0,
+            total_lost INTEGER DEFAULT 0,
+            max INTEGER DEFAULT 0,
+            PRIMARY KEY (user_id, guild_id),
+            FOREIGN KEY (user_id, guild_id) REFERENCES users(user_id, guild_id)
+        );
+        """,
+        """
+        INSERT INTO cookies_new (user_id, guild_id, cookies, total_earned, total_lost, max)
+        SELECT user_id, guild_id, MAX(cookies), MAX(total_earned), MAX(total_lost), MAX(max)
+        FROM cookies
+        WHERE user_id IS NOT NULL AND guild_id IS NOT NULL
+        GROUP BY user_id, guild_id;
+        """,
+        "DROP TABLE cookies;",
+        "ALTER TABLE cookies_new RENAME TO cookies;",
+        """
+        CREATE TABLE fishing_stats_core_new (
+            user_id INTEGER NOT NULL,
+            guild_id INTEGER NOT NULL,
+            total_fish_caught INTEGER DEFAULT 0,
+            total_weight INTEGER DEFAULT 0,
+            total_value INTEGER DEFAULT 0,
+            level INTEGER DEFAULT 0,
+            experience INTEGER DEFAULT 0,
+            PRIMARY KEY (user_id, guild_id),
+            FOREIGN KEY (user_id, guild_id) REFERENCES users(user_id, guild_id)
+        );
+        """,
+        """
+        INSERT INTO fishing_stats_core_new (
+            user_id, guild_id, total_fish_caught, total_weight, total_value, level, experience
+        )
+        SELECT user_id, guild_id, MAX(total_fish_caught), MAX(total_weight),
+               MAX(total_value), MAX(level), MAX(experience)
+        FROM fishing_stats_core
+        GROUP BY user_id, guild_id;
+        """,
+        "DROP TABLE fishing_stats_core;",
+        "ALTER TABLE fishing_stats_core_new RENAME TO fishing_stats_core;",
+        # user_id is included so leaderboard queries are answered from the index
+        """
+        CREATE INDEX cookies_leaderboard
+        ON cookies (guild_id, cookies DESC, user_id);
+        """,
+        """
+        CREATE INDEX fishing_caught_leaderboard
+        ON fishing_stats_core (guild_id, total_fish_caught DESC, user_id);
+        """,
+        """
+        CREATE INDEX fishing_weight_leaderboard
+        ON fishing_stats_core (guild_id, total_weight DESC, user_id);
+        """,
+        """
+        CREATE INDEX fishing_value_leaderboard
+        ON fishing_stats_core (guild_id, total_value DESC, user_id);
+        """,
+        """
+        CREATE INDEX fishing_level_leaderboard
+        ON fishing_stats_core (guild_id, level DESC, experience DESC, user_id);
+        """,
+    ),
+    # 2: Merge rows whose IDs were stored as TEXT/REAL into their INTEGER twin
+    (
+        """
+        INSERT OR IGNORE INTO users (user_id, guild_id)
+        SELECT CAST(user_id AS INTEGER), CAST(guild_id AS INTEGER)
+        FROM users
+        WHERE typeof(user_id) != 'integer' OR typeof(guild_id) != 'integer';
+        """,
+        """
+        DELETE FROM users
+        WHERE typeof(user_id) != 'integer' OR typeof(guild_id) != 'integer';
+        """,
+        """
+        INSERT INTO cookies (user_id, guild_id, cookies, total_earned, total_lost, max)
+        SELECT CAST(user_id AS INTEGER), CAST(guild_id AS INTEGER), SUM(cookies),
+               SUM(total_earned), SUM(total_lost), MAX(max)
+        FROM cookies
+        WHERE typeof(user_id) != 'integer' OR typeof(guild_id) != 'integer'
+        GROUP BY CAST(user_id AS INTEGER), CAST(guild_id AS INTEGER)
+        ON CONFLICT (user_id, guild_id) DO UPDATE SET
+            cookies = cookies + excluded.cookies,
+            total_earned = total_earned + excluded.total_earned,
+            total_lost = total_lost + excluded.total_lost,
+            max = MAX(max, excluded.max, cookies + excluded.cookies);
+        """,
+        """
+        DELETE FROM cookies
+        WHERE typeof(user_id) != 'integer' OR typeof(guild_id) != 'integer';
+        """,
+        """
+        INSERT INTO fishing_stats_core (
+            user_id, guild_id, total_fish_caught, total_weight, total_value, level, experience
+        )
+        SELECT CAST(user_id AS INTEGER), CAST(guild_id AS INTEGER), SUM(total_fish_caught),
+               SUM(total_weight), SUM(total_value), MAX(level), MAX(experience)
+        FROM fishing_stats_core
+        WHERE typeof(user_id) != 'integer' OR typeof(guild_id) != 'integer'
+        GROUP BY CAST(user_id AS INTEGER), CAST(guild_id AS INTEGER)
+        ON CONFLICT (user_id, guild_id) DO UPDATE SET
+            total_fish_caught = total_fish_caught + excluded.total_fish_caught,
+            total_weight = total_weight + excluded.total_weight,
+            total_value = total_value + excluded.total_value,
+            level = MAX(level, excluded.level),
+            experience = MAX(experience, excluded.experience);
+        """,
+        """
+        DELETE FROM fishing_stats_core
+        WHERE typeof(user_id) != 'integer' OR typeof(guild_id) != 'integer';
+        """,
+        # "owned" holds a rod state (0 none, 1 owned, 2 equipped), every other stat a count
+        """
+        INSERT INTO fishing_stats_items (
+            user_id, guild_id, item_type, item_name, stat_type, value
+        )
+        SELECT CAST(user_id AS INTEGER), CAST(guild_id AS INTEGER), item_type,
+               item_name, stat_type,
+               CASE stat_type WHEN 'owned' THEN MAX(value) ELSE SUM(value) END
+        FROM fishing_stats_items
+        WHERE typeof(user_id) != 'integer' OR typeof(guild_id) != 'integer'
+        GROUP BY CAST(user_id AS INTEGER), CAST(guild_id AS INTEGER), item_type,
+                 item_name, stat_type
+        ON CONFLICT (user_id, guild_id, item_type, item_name, stat_type) DO UPDATE SET
+            value = CASE stat_type
+                WHEN 'owned' THEN MAX(value, excluded.value)
+                ELSE value + excluded.value
+            END;
+        """,
+        """
+        DELETE FROM fishing_stats_items
+        WHERE typeof(user_id) != 'integer' OR typeof(guild_id) != 'integer';
+        """,
+    ),
+    # 3: Economy ledger, plus the daily rollup that old ledger rows compact into
+    (
+        """
+        CREATE TABLE cookie_ledger (
+            id INTEGER PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            guild_id INTEGER NOT NULL,
+            amount INTEGER NOT NULL,
+            source TEXT NOT NULL,
+            created_at INTEGER NOT NULL
+        );
+        """,
+        """
+        CREATE INDEX cookie_ledger_source
+        ON cookie_ledger (guild_id, source, created_at);
+        """,
+        "CREATE INDEX cookie_ledger_created_at ON cookie_ledger (created_at);",
+        # Opening balances, so every member's ledger sums to their balance
+        """
+        INSERT INTO cookie_ledger (user_id, guild_id, amount, source, created_at)
+        SELECT user_id, guild_id, cookies, 'opening', CAST(strftime('%s', 'now') AS INTEGER)
+        FROM cookies
+        WHERE cookies != 0;
+        """,
+        """
+        CREATE TABLE cookie_ledger_daily (
+            user_id INTEGER NOT NULL,
+            guild_id INTEGER NOT NULL,
+            source TEXT NOT NULL,
+            day INTEGER NOT NULL,
+            amount INTEGER NOT NULL,
+            entries INTEGER NOT NULL,
+            PRIMARY KEY (guild_id, source, day, user_id)
+        ) WITHOUT ROWID;
+        """,
+    ),
+    # 4: Members who left a guild, so their rows can be skipped by the leaderboards
+    (
+        """
+        CREATE TABLE departed_members (
+            guild_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            left_at INTEGER NOT NULL,
+            PRIMARY KEY (guild_id, user_id)
+        ) WITHOUT ROWID;
+        """,
+    ),
+    # 5: Timed effects (mutes, deafens) waiting to be reversed by the scheduler
+    (
+        """
+        CREATE TABLE timed_effects (
+            id INTEGER PRIMARY KEY,
+            guild_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            effect TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        );
+        """,
+    ),
+    # 6: The equipped rod moves onto the core row, read with the rest of the stats;
+    # a rod's "owned" stat is now just 0 or 1
+    (
+        "ALTER TABLE fishing_stats_core ADD COLUMN equipped_rod TEXT;",
+        """
+        UPDATE fishing_stats_core SET equipped_rod = (
+            SELECT item_name FROM fishing_stats_items
+            WHERE fishing_stats_items.user_id = fishing_stats_core.user_id
+            AND fishing_stats_items.guild_id = fishing_stats_core.guild_id
+            AND item_type = 'rod' AND stat_type = 'owned' AND value = 2
+            LIMIT 1
+        );
+        """,
+        """
+        UPDATE fishing_stats_items SET value = 1
+        WHERE item_type = 'rod' AND stat_type = 'owned' AND value = 2;
+        """,
+    ),
+    # 7: Covering index for the per-species leaderboards
+    (
+        """
+        CREATE INDEX fishing_species_leaderboard
+        ON fishing_stats_items (guild_id, item_type, item_name, stat_type, value DESC, user_id);
+        """,
+    ),
+    # 8: Catalog of fishing items and stat types, with fishing_stats_items rekeyed
+    # to their integer IDs
+    (
+        """
+        CREATE TABLE fishing_items (
+            id INTEGER PRIMARY KEY,
+            item_type TEXT NOT NULL,
+            item_name TEXT NOT NULL,
+            UNIQUE (item_type, item_name)
+        );
+        """,
+        """
+        CREATE TABLE fishing_stat_types (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL UNIQUE
+        );
+        """,
+        """
+        INSERT INTO fishing_items (item_type, item_name)
+        SELECT DISTINCT item_type, item_name FROM fishing_stats_items
+        ORDER BY item_type, item_name;
+        """,
+        """
+        INSERT INTO fishing_stat_types (name)
+        SELECT DISTINCT stat_type FROM fishing_stats_items ORDER BY stat_type;
+        """,
+        """
+        CREATE TABLE fishing_stats_items_new (
+            user_id INTEGER NOT NULL,
+            guild_id INTEGER NOT NULL,
+            item_id INTEGER NOT NULL REFERENCES fishing_items(id),
+            stat_id INTEGER NOT NULL REFERENCES fishing_stat_types(id),
+            value INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, guild_id, item_id, stat_id),
+            FOREIGN KEY (user_id, guild_id) REFERENCES users(user_id, guild_id)
+        ) WITHOUT ROWID;
+        """,
+        """
+        INSERT INTO fishing_stats_items_new (user_id, guild_id, item_id, stat_id, value)
+        SELECT fishing_stats_items.user_id, fishing_stats_items.guild_id,
+               fishing_items.id, fishing_stat_types.id, COALESCE(fishing_stats_items.value, 0)
+        FROM fishing_stats_items
+        JOIN fishing_items
+            ON fishing_items.item_type = fishing_stats_items.item_type
+            AND fishing_items.item_name = fishing_stats_items.item_name
+        JOIN fishing_stat_types ON fishing_stat_types.name = fishing_stats_items.stat_type;
+        """,
+        "DROP TABLE fishing_stats_items;",
+        "ALTER TABLE fishing_stats_items_new RENAME TO fishing_stats_items;",
+        """
+        CREATE INDEX fishing_species_leaderboard
+        ON fishing_stats_items (guild_id, item_id, stat_id, value DESC, user_id);
+        """,
+    ),
+]
@@ -1,92 +1,396 @@
+import asyncio
+import time
+from collections import OrderedDict
+from contextlib import AsyncExitStack, asynccontextmanager
+from typing import AsyncIterator, Iterable, List, Optional, Sequence, Tuple
+from weakref import WeakValueDictionary
+
+import aiosqlite
+
 from utils.database import Database
+from utils.leaderboard import Leaderboards
+
+# Each balance change is one conditional UPDATE, so concurrent commands can
+# never act on a stale balance. Right-hand sides see the row's old values.
+LOSE_QUERY = """
+    UPDATE cookies
+    SET cookies = cookies - :amount, total_lost = total_lost + :amount
+    WHERE user_id = :user_id AND guild_id = :guild_id AND cookies >= :amount
+"""
+EARN_QUERY = """
+    UPDATE cookies
+    SET cookies = cookies + :amount,
+        total_earned = total_earned + :amount,
+        max = MAX(max, cookies + :amount)
+    WHERE user_id = :user_id AND guild_id = :guild_id
+"""
+LEDGER_QUERY = """
+    INSERT INTO cookie_ledger (user_id, guild_id, amount, source, created_at)
+    VALUES (?, ?, ?, ?, ?);
+"""
+
+# Ledger rows older than this are folded into cookie_ledger_daily
+LEDGER_RETENTION = 30 * 24 * 60 * 60
+
+# cookies, total_earned, total_lost, max
+CookieRow = Tuple[int, int, int, int]
+RETURNING = "RETURNING cookies, total_earned, total_lost, max;"
 
 
 class Money:
-    def __init__(self, db: Database):
+    def __init__(self, db: Database, cache_size: int = 10_000):
         self.db = db
 
-    def lose(self, user_id, guild_id, amount) -> bool:
-        balance = self.get_money(user_id, guild_id)
+        # Write-through LRU of cookies rows keyed by (guild_id, user_id). Every
+        # balance change goes through this instance, so share one per bot.
+        self.cache: OrderedDict[Tuple[int, int], CookieRow] = OrderedDict()
+        self.cache_size = cache_size
+        # Bumped by bulk operations, which drop cache entries without locking
+        self.cache_epoch = 0
+        # Per-user locks serialize each user's read-modify-write; unused locks
+        # are garbage collected
+        self.locks: WeakValueDictionary[Tuple[int, int], asyncio.Lock] = (
+            WeakValueDictionary()
+        )
+        # Per-guild rankings, updated with every balance this instance writes
+        self.leaderboards = Leaderboards(db, "cookies", "cookies")
 
-        # Check if enough money
-        if balance < amount:
-            return False
+    def lock(self, user_id, guild_id) -> asyncio.Lock:
+        key = (guild_id, user_id)
+        lock = self.locks.get(key)
+        if lock is None:
+            lock = self.locks[key] = asyncio.Lock()
+        return lock
 
-        # Update values
-        balance = balance - amount
-        total_lost = self.get_total_lost(user_id, guild_id) + amount
-
-        # Update database
-        # Balance
-        self.db.set_value(
-            user_id,
-            guild_id,
-            "cookies",
-            "cookies",
-            balance,
-        )
+    def _cache_get(self, key: Tuple[int, int]) -> Optional[CookieRow]:
+        row = self.cache.get(key)
+        if row is not None:
+            self.cache.move_to_end(key)
+        return row
+
+    def _cache_put(self, key: Tuple[int, int], row: CookieRow) -> None:
+        self.cache[key] = row
+        self.cache.move_to_end(key)
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    def _cache_drop(self, keys: Iterable[Tuple[int, int]]) -> None:
+        """Forgets cached rows and rankings that may no longer match the database."""
+        self.cache_epoch += 1
+        guild_ids = set()
+        for key in keys:
+            self.cache.pop(key, None)
+            guild_ids.add(key[0])
 
-        # Total lost
-        self.db.set_value(
-            user_id,
-            guild_id,
-            "cookies",
-            "total_lost",
-            total_lost,
+        for guild_id in guild_ids:
+            self.leaderboards.invalidate(guild_id)
+
+    async def _record(
+        self,
+        conn: aiosqlite.Connection,
+        changes: Iterable[Tuple[int, int, int]],
+        source: str,
+    ) -> None:
+        """Writes ledger entries for (user_id, guild_id, amount) changes.
+
+        Always called in the transaction that changes the balances, so the
+        ledger and the cookies table commit or roll back together.
+        """
+        now = int(time.time())
+        await conn.executemany(
+            LEDGER_QUERY,
+            [
+                (user_id, guild_id, amount, source, now)
+                for user_id, guild_id, amount in changes
+            ],
         )
 
+    async def _apply(
+        self, conn: aiosqlite.Connection, query: str, user_id, guild_id, amount
+    ) -> Optional[CookieRow]:
+        """Runs a balance UPDATE and caches the new row, or returns None if no row matched."""
+        async with conn.execute(
+            f"{query} {RETURNING}",
+            {"user_id": user_id, "guild_id": guild_id, "amount": amount},
+        ) as cursor:
+            row = await cursor.fetchone()
+
+        if row is None:
+            return None
+
+        # Cached while the transaction still holds the writer, so no other
+        # write can land between this update and the cache entry
+        self._cache_put((guild_id, user_id), tuple(row))
+        self.leaderboards.update(guild_id, user_id, row[0])
+        return tuple(row)
+
+    @asynccontextmanager
+    async def _write(
+        self, *keys: Tuple[int, int], flush: bool = False
+    ) -> AsyncIterator[aiosqlite.Connection]:
+        """Opens a write transaction, dropping the keys from the cache if it fails."""
+        try:
+            if flush:
+                async with self.db.flushing_transaction() as conn:
+                    yield conn
+            else:
+                async with self.db.transaction() as conn:
+                    yield conn
+        except BaseException:
+            self._cache_drop(keys)
+            raise
+
+    @asynccontextmanager
+    async def transaction(
+        self, user_id, guild_id
+    ) -> AsyncIterator[aiosqlite.Connection]:
+        """Locks a user's balance for change() calls that must commit with other writes.
+
+        The transaction also commits every queued database write, so the caller
+        may write queued rows too, e.g. with FishingStats.save(conn).
+        """
+        async with self.lock(user_id, guild_id):
+            await self.db.ensure_user(user_id, guild_id)
+            async with self._write((guild_id, user_id), flush=True) as conn:
+                yield conn
+
+    async def change(
+        self, conn: aiosqlite.Connection, user_id, guild_id, amount, source: str
+    ) -> bool:
+        """Adds amount, or takes it if negative, inside transaction().
+
+        Returns False, changing nothing, if the balance is too low.
+        """
+        query = EARN_QUERY if amount >= 0 else LOSE_QUERY
+        if await self._apply(conn, query, user_id, guild_id, abs(amount)) is None:
+            return False
+        await self._record(conn, [(user_id, guild_id, amount)], source)
         return True
 
-    def earn(self, user_id, guild_id, amount) -> bool:
-        balance = self.get_money(user_id, guild_id)
-
-        # Update values
-        balance = balance + amount
-        total_earned = self.get_total_earned(user_id, guild_id) + amount
-
-        # Update database
-        # Balance
-        self.db.set_value(
-            user_id,
-            guild_id,
-            "cookies",
-            "cookies",
-            balance,
-        )
+    async def _load(self, user_id, guild_id) -> CookieRow:
+        key = (guild_id, user_id)
+        row = self._cache_get(key)
+        if row is not None:
+            return row
 
-        # Total Earned
-        self.db.set_value(
-            user_id,
-            guild_id,
-            "cookies",
-            "total_earned",
-            total_earned,
-        )
+        async with self.lock(user_id, guild_id):
+            row = self._cache_get(key)
+            if row is not None:
+                return row
 
-        # Max
-        max = self.get_max(user_id, guild_id)
-        if balance > max:
-            self.db.set_value(
+            epoch = self.cache_epoch
+            row = await self.db.get_row(
                 user_id,
                 guild_id,
                 "cookies",
-                "max",
-                balance,
+                ("cookies", "total_earned", "total_lost", "max"),
+            )
+            if epoch == self.cache_epoch:
+                self._cache_put(key, row)
+            return row
+
+    async def lose(self, user_id, guild_id, amount, source: str) -> bool:
+        async with self.lock(user_id, guild_id):
+            # The cache is write-through, so a cached balance is authoritative
+            cached = self._cache_get((guild_id, user_id))
+            if cached is not None and cached[0] < amount:
+                return False
+
+            await self.db.ensure_user(user_id, guild_id)
+            async with self._write((guild_id, user_id)) as conn:
+                row = await self._apply(conn, LOSE_QUERY, user_id, guild_id, amount)
+                # No row is updated when the balance is too low
+                if row is None:
+                    return False
+                await self._record(conn, [(user_id, guild_id, -amount)], source)
+
+        return True
+
+    async def earn(self, user_id, guild_id, amount, source: str) -> bool:
+        async with self.lock(user_id, guild_id):
+            await self.db.ensure_user(user_id, guild_id)
+            async with self._write((guild_id, user_id)) as conn:
+                await self._apply(conn, EARN_QUERY, user_id, guild_id, amount)
+                await self._record(conn, [(user_id, guild_id, amount)], source)
+
+        return True
+
+    async def transfer(
+        self, sender_id, recipient_id, guild_id, amount, source: str = "give"
+    ) -> bool:
+        """Moves cookies between two users in a single transaction."""
+        async with AsyncExitStack() as stack:
+            # Lock in a fixed order so opposite transfers cannot deadlock
+            for user_id in sorted({sender_id, recipient_id}):
+                await stack.enter_async_context(self.lock(user_id, guild_id))
+
+            await self.db.ensure_users(
+                [(sender_id, guild_id), (recipient_id, guild_id)]
             )
 
+            keys = ((guild_id, sender_id), (guild_id, recipient_id))
+            async with self._write(*keys) as conn:
+                if (
+                    await self._apply(conn, LOSE_QUERY, sender_id, guild_id, amount)
+                    is None
+                ):
+                    return False
+                await self._apply(conn, EARN_QUERY, recipient_id, guild_id, amount)
+                await self._record(
+                    conn,
+                    [(sender_id, guild_id, -amount), (recipient_id, guild_id, amount)],
+                    source,
+                )
+
         return True
 
-    def set_money(self, user_id, guild_id, amount):
-        return self.db.set_value(user_id, guild_id, "cookies", "cookies", amount)
+    async def earn_many(
+        self, payouts: Sequence[Tuple[int, int, int]], source: str
+    ) -> None:
+        """Credits many (user_id, guild_id, amount) payouts in one transaction."""
+        if not payouts:
+            return
+
+        await self.db.ensure_users(
+            (user_id, guild_id) for user_id, guild_id, _ in payouts
+        )
+
+        keys = [(guild_id, user_id) for user_id, guild_id, _ in payouts]
+        async with self._write(*keys) as conn:
+            await conn.executemany(
+                EARN_QUERY,
+                [
+                    {"user_id": user_id, "guild_id": guild_id, "amount": amount}
+                    for user_id, guild_id, amount in payouts
+                ],
+            )
+            await self._record(conn, payouts, source)
 
-    def get_money(self, user_id, guild_id) -> int:
-        return self.db.get_value(user_id, guild_id, "cookies", "cookies")[0]
+        # Too many rows to lock one by one; re-read them on next use instead.
+        # Dropped only once committed, so a load racing the commit cannot cache
+        # the old row.
+        self._cache_drop(keys)
 
-    def get_total_earned(self, user_id, guild_id) -> int:
-        return self.db.get_value(user_id, guild_id, "cookies", "total_earned")[0]
+    async def transfer_many(
+        self,
+        sender_id,
+        guild_id,
+        payouts: Sequence[Tuple[int, int]],
+        source: str = "give",
+    ) -> bool:
+        """Pays many (recipient_id, amount) pairs from one sender, all or nothing."""
+        if not payouts:
+            return True
 
-    def get_total_lost(self, user_id, guild_id) -> int:
-        return self.db.get_value(user_id, guild_id, "cookies", "total_lost")[0]
+        total = sum(amount for _, amount in payouts)
+        await self.db.ensure_users(
+            [(sender_id, guild_id)]
+            + [(recipient_id, guild_id) for recipient_id, _ in payouts]
+        )
 
-    def get_max(self, user_id, guild_id) -> int:
-        return self.db.get_value(user_id, guild_id, "cookies", "max")[0]
+        keys = [(guild_id, recipient_id) for recipient_id, _ in payouts]
+        async with self.lock(sender_id, guild_id):
+            async with self._write((guild_id, sender_id), *keys) as conn:
+                if (
+                    await self._apply(conn, LOSE_QUERY, sender_id, guild_id, total)
+                    is None
+                ):
+                    return False
+                await conn.executemany(
+                    EARN_QUERY,
+                    [
+                        {
+                            "user_id": recipient_id,
+                            "guild_id": guild_id,
+                            "amount": amount,
+                        }
+                        for recipient_id, amount in payouts
+                    ],
+                )
+                await self._record(
+                    conn,
+                    [(sender_id, guild_id, -total)]
+                    + [
+                        (recipient_id, guild_id, amount)
+                        for recipient_id, amount in payouts
+                    ],
+                    source,
+                )
+
+        # As in earn_many(), only after the commit
+        self._cache_drop(keys)
+        return True
+
+    async def set_money(self, user_id, guild_id, amount, source: str = "set"):
+        async with self.lock(user_id, guild_id):
+            await self.db.ensure_user(user_id, guild_id)
+
+            async with self._write((guild_id, user_id)) as conn:
+                async with conn.execute(
+                    """
+                    SELECT cookies FROM cookies WHERE user_id = ? AND guild_id = ?;
+                    """,
+                    (user_id, guild_id),
+                ) as cursor:
+                    (previous,) = await cursor.fetchone() or (0,)
+                await self._apply(
+                    conn,
+                    """
+                    UPDATE cookies SET cookies = :amount
+                    WHERE user_id = :user_id AND guild_id = :guild_id
+                    """,
+                    user_id,
+                    guild_id,
+                    amount,
+                )
+                await self._record(
+                    conn, [(user_id, guild_id, amount - previous)], source
+                )
+
+    async def get_money(self, user_id, guild_id) -> int:
+        return (await self._load(user_id, guild_id))[0]
+
+    async def get_stats(self, user_id, guild_id) -> CookieRow:
+        """Returns (cookies, total_earned, total_lost, max), from cache when possible."""
+        return await self._load(user_id, guild_id)
+
+    async def get_top_earners(
+        self, guild_id, source: str, since: int, limit: int = 10
+    ) -> List[Tuple[int, int]]:
+        """Returns (user_id, net amount) for a ledger source since a unix timestamp."""
+        return await self.db.fetchall(
+            """
+            SELECT user_id, SUM(amount) AS total
+            FROM cookie_ledger
+            WHERE guild_id = ? AND source = ? AND created_at >= ?
+            GROUP BY user_id
+            ORDER BY total DESC
+            LIMIT ?;
+            """,
+            (guild_id, source, since, limit),
+        )
+
+    async def compact_ledger(self, retention: int = LEDGER_RETENTION) -> None:
+        """Rolls ledger rows older than retention seconds up into daily totals."""
+        cutoff = int(time.time()) - retention
+
+        async with self.db.transaction() as conn:
+            await conn.execute(
+                """
+                INSERT INTO cookie_ledger_daily (user_id, guild_id, source, day, amount, entries)
+                SELECT user_id, guild_id, source, created_at / 86400, SUM(amount), COUNT(*)
+                FROM cookie_ledger
+                WHERE created_at < ?
+                GROUP BY user_id, guild_id, source, created_at / 86400
+                ON CONFLICT (guild_id, source, day, user_id) DO UPDATE SET
+                    amount = amount + excluded.amount,
+                    entries = entries + excluded.entries;
+                """,
+                (cutoff,),
+            )
+            await conn.execute(
+                """
+                DELETE FROM cookie_ledger WHERE created_at < ?;
+                """,
+                (cutoff,),
+            )
@@ -0,0 +1,60 @@
+import random
+from typing import List, Optional, Sequence
+
+
+class AliasTable:
+    """Draws index i with probability weights[i] / sum(weights) in O(1).
+
+    Built once in O(n) with Vose's alias method.
+    """
+
+    __slots__ = ("probability", "alias")
+
+    def __init__(self, weights: Sequence[float]) -> None:
+        total = sum(weights)
+        if not weights or total <= 0:
+            raise ValueError("AliasTable needs at least one positive weight")
+        if min(weights) < 0:
+            raise ValueError("AliasTable weights cannot be negative")
+
+        count = len(weights)
+        scaled = [weight * count / total for weight in weights]
+        # Column i keeps itself with probability[i] and otherwise yields alias[i]
+        self.probability: List[float] = [1.0] * count
+        self.alias: List[int] = list(range(count))
+
+        small = [i for i, share in enumerate(scaled) if share < 1]
+        large = [i for i, share in enumerate(scaled) if share >= 1]
+        while small and large:
+            less, more = small.pop(), large.pop()
+            self.probability[less] = scaled[less]
+            self.alias[less] = more
+            scaled[more] -= 1 - scaled[less]
+            (small if scaled[more] < 1 else large).append(more)
+
+        # Whatever is left is 1 up to rounding error and keeps probability 1.0
+
+    def __len__(self) -> int:
+        return len(self.probability)
+
+    def sample(self, rng: Optional[random.Random] = None) -> int:
+        """Draws an index, using the module-level random functions unless rng is given."""
+        draw = rng or random
+        column = draw.randrange(len(self.probability))
+        if draw.random() < self.probability[column]:
+            return column
+        return self.alias[column]
+
+    def sample_accepting(
+        self, acceptance: Sequence[float], rng: Optional[random.Random] = None
+    ) -> int:
+        """Draws with weights[i] scaled by acceptance[i], each in (0, 1], by rejection.
+
+        This reweights the table without rebuilding it; it takes 1 / E[acceptance]
+        draws on average.
+        """
+        draw = rng or random
+        while True:
+            index = self.sample(rng)
+            if draw.random() < acceptance[index]:
+                return index
@@ -0,0 +1,151 @@
+import asyncio
+import heapq
+import logging
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import discord
+
+from utils.database import Database
+
+logger = logging.getLogger(__name__)
+
+# Effect name -> the member.edit() arguments that undo it
+REVERSALS: Dict[str, Dict[str, Any]] = {
+    "mute": {"mute": False},
+    "deafen": {"deafen": False},
+}
+
+# Effects expiring within this many seconds of each other are reversed together
+TICK = 0.5
+
+# (expires_at, id, guild_id, user_id, effect)
+TimedEffect = Tuple[float, int, int, int, str]
+
+
+class Scheduler:
+    """Owns every timed effect and reverses them when they expire.
+
+    Effects are persisted to the timed_effects table, so the ones still pending
+    when the bot stops are picked up again by start().
+    """
+
+    def __init__(self, client: discord.Client, db: Database) -> None:
+        self.client = client
+        self.db = db
+        self.heap: List[TimedEffect] = []
+        # How many effects of each kind are pending per member, so an earlier
+        # effect expiring does not cut a later one short
+        self.active: Dict[Tuple[int, int, str], int] = {}
+        self.wakeup = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        rows = await self.db.fetchall(
+            """
+            SELECT expires_at, id, guild_id, user_id, effect FROM timed_effects;
+            """
+        )
+        self.heap = [tuple(row) for row in rows]
+        heapq.heapify(self.heap)
+        for _, _, guild_id, user_id, effect in self.heap:
+            key = (guild_id, user_id, effect)
+            self.active[key] = self.active.get(key, 0) + 1
+
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    async def schedule(self, guild_id: int, user_id: int, effect: str, delay: float):
+        """Reverses effect on the member after delay seconds."""
+        if effect not in REVERSALS:
+            raise ValueError(f"Unknown timed effect: {effect}")
+
+        expires_at = time.time() + delay
+        async with self.db.transaction() as conn:
+            cursor = await conn.execute(
+                """
+                INSERT INTO timed_effects (guild_id, user_id, effect, expires_at)
+                VALUES (?, ?, ?, ?);
+                """,
+                (guild_id, user_id, effect, expires_at),
+            )
+            effect_id = cursor.lastrowid
+
+        key = (guild_id, user_id, effect)
+        self.active[key] = self.active.get(key, 0) + 1
+        heapq.heappush(self.heap, (expires_at, effect_id, guild_id, user_id, effect))
+        # Only the earliest effect decides how long the loop sleeps
+        if self.heap[0][1] == effect_id:
+            self.wakeup.set()
+
+    async def _run(self) -> None:
+        await self.client.wait_until_ready()
+
+        while True:
+            self.wakeup.clear()
+            if not self.heap:
+                await self.wakeup.wait()
+                continue
+
+            delay = self.heap[0][0] - time.time()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            due = []
+            cutoff = time.time() + TICK
+            while self.heap and self.heap[0][0] <= cutoff:
+                due.append(heapq.heappop(self.heap))
+
+            try:
+                await self._expire(due)
+            except Exception:
+                logger.exception("Failed to expire %d timed effects", len(due))
+
+    async def _expire(self, due: List[TimedEffect]) -> None:
+        # One member.edit() per member, covering every effect that ran out
+        edits: Dict[Tuple[int, int], Dict[str, Any]] = {}
+        for _, _, guild_id, user_id, effect in due:
+            key = (guild_id, user_id, effect)
+            self.active[key] -= 1
+            if self.active[key]:
+                continue
+            del self.active[key]
+            edits.setdefault((guild_id, user_id), {}).update(REVERSALS[effect])
+
+        results = await asyncio.gather(
+            *(
+                self._reverse(guild_id, user_id, changes)
+                for (guild_id, user_id), changes in edits.items()
+            ),
+            return_exceptions=True,
+        )
+        for result in results:
+            if isinstance(result, Exception):
+                logger.warning("Could not reverse a timed effect: %s", result)
+
+        async with self.db.transaction() as conn:
+            await conn.executemany(
+                """
+                DELETE FROM timed_effects WHERE id = ?;
+                """,
+                [(effect_id,) for _, effect_id, _, _, _ in due],
+            )
+
+    async def _reverse(self, guild_id: int, user_id: int, changes: Dict[str, Any]):
+        guild = self.client.get_guild(guild_id)
+        member = guild.get_member(user_id) if guild else None
+        if member is None:
+            return
+        await member.edit(**changes)
@@ -0,0 +1,177 @@
+"""Offline simulator for the fishing economy configured in config.toml.
+
+Usage: python -m utils.simulation [--config config.toml] [--levels 0 10 25 50]
+                                  [--bait NAME]
+"""
+
+import argparse
+import time
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from models.fishing import Bait, FishingSettings, Rod
+from utils.config import load_settings
+
+# Matches the cooldown of a single /fish cast
+CAST_COOLDOWN = 5.0
+
+# Casts are simulated in chunks of this size to bound memory use
+CHUNK_SIZE = 1 << 20
+
+
+def rarity_modifier(rod: Rod, bait: Optional[Bait] = None) -> float:
+    # Added up the same way /fish cast does
+    return rod.rarity_modifier + (bait.rarity_modifier if bait else 0.0)
+
+
+def simulate_cookies_per_cast(
+    settings: FishingSettings,
+    level: int,
+    rod: Rod,
+    casts: int,
+    rng: np.random.Generator,
+    bait: Optional[Bait] = None,
+) -> float:
+    """Returns the mean cookies earned per cast over casts simulated casts, net of bait."""
+    chance = min(settings.catch_chance(level, rod, bait), 1.0)
+    prices = np.array([rarity.price for rarity in settings.rarity], dtype=np.int64)
+    odds = settings.rarity_odds(rarity_modifier(rod, bait))
+
+    total = 0
+    for start in range(0, casts, CHUNK_SIZE):
+        size = min(CHUNK_SIZE, casts - start)
+        caught = rng.random(size) < chance
+        rarities = rng.choice(len(prices), size=size, p=odds)
+        total += int(prices[rarities][caught].sum())
+
+    return total / casts - (bait.price if bait else 0)
+
+
+def simulate_casts_per_level(
+    settings: FishingSettings,
+    rod: Rod,
+    levels: int,
+    players: int,
+    rng: np.random.Generator,
+    bait: Optional[Bait] = None,
+) -> np.ndarray:
+    """Returns the mean casts needed to finish each of the first levels levels."""
+    chances = np.minimum(
+        [settings.catch_chance(level, rod, bait) for level in range(levels)], 1.0
+    )
+    # Each level takes settings.experience catches; the misses in between are
+    # negative binomially distributed
+    misses = rng.negative_binomial(settings.experience, chances, size=(players, levels))
+    return settings.experience + misses.mean(axis=0)
+
+
+def format_duration(seconds: float) -> str:
+    if seconds == float("inf"):
+        return "never"
+    hours, seconds = divmod(int(seconds), 3600)
+    minutes = seconds // 60
+    return f"{hours}h {minutes:02d}m"
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        description="Simulate the fishing economy in config.toml."
+    )
+    parser.add_argument("--config", default="config.toml")
+    parser.add_argument(
+        "--levels", type=int, nargs="+", default=[0, 10, 25, 50], metavar="LEVEL"
+    )
+    parser.add_argument(
+        "--casts", type=int, default=1_000_000, help="casts per level and rod"
+    )
+    parser.add_argument(
+        "--players", type=int, default=10_000, help="players simulated levelling up"
+    )
+    parser.add_argument(
+        "--cooldown", type=float, default=CAST_COOLDOWN, help="seconds per cast"
+    )
+    parser.add_argument(
+        "--bait", metavar="NAME", help="bait used on every cast, charged per cast"
+    )
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args(argv)
+
+    settings = load_settings(args.config).fishing
+    bait: Optional[Bait] = None
+    if args.bait is not None:
+        bait = next((bait for bait in settings.bait if bait.name == args.bait), None)
+        if bait is None:
+            names = ", ".join(bait.name for bait in settings.bait)
+            parser.error(f"unknown bait {args.bait!r}; choose from {names}")
+    rng = np.random.default_rng(args.seed)
+    default_rod = settings.rod[0]
+    max_level = max(args.levels)
+
+    started = time.perf_counter()
+    cookies: Dict[int, List[float]] = {
+        level: [
+            simulate_cookies_per_cast(settings, level, rod, args.casts, rng, bait)
+            for rod in settings.rod
+        ]
+        for level in args.levels
+    }
+    elapsed = time.perf_counter() - started
+    simulated = args.casts * len(args.levels) * len(settings.rod)
+    print(
+        f"Simulated {simulated:,} casts in {elapsed:.2f}s "
+        f"({simulated / elapsed:,.0f} casts/s)\n"
+    )
+
+    casts_per_level = [
+        simulate_casts_per_level(settings, rod, max_level + 1, args.players, rng, bait)
+        for rod in settings.rod
+    ]
+
+    if bait is not None:
+        print(f"Every cast uses {bait.name}, for {bait.price} cookies\n")
+
+    print("Expected earnings")
+    print(
+        f"{'Level':>5}  {'Rod':<24} {'Catch':>7} {'Cookies/cast':>13}"
+        f" {'Casts/level':>12} {'Time/level':>11}"
+    )
+    for level in args.levels:
+        for index, rod in enumerate(settings.rod):
+            casts = casts_per_level[index][level]
+            print(
+                f"{level:>5}  {rod.name:<24}"
+                f" {min(settings.catch_chance(level, rod, bait), 1.0):>7.1%}"
+                f" {cookies[level][index]:>13.2f}"
+                f" {casts:>12.1f}"
+                f" {format_duration(casts * args.cooldown):>11}"
+            )
+    print()
+
+    print(f"Time to reach level {max_level} from 0")
+    for index, rod in enumerate(settings.rod):
+        casts = casts_per_level[index][:max_level].sum()
+        print(
+            f"  {rod.name:<24} {casts:>10,.0f} casts"
+            f" {format_duration(casts * args.cooldown):>11}"
+        )
+    print()
+
+    print(f"Rod return on investment, compared to {default_rod.name}")
+    print(
+        f"{'Level':>5}  {'Rod':<24} {'Price':>7} {'Extra/cast':>11}"
+        f" {'Payback casts':>14} {'Payback time':>13}"
+    )
+    for level in args.levels:
+        for index, rod in enumerate(settings.rod[1:], start=1):
+            extra = cookies[level][index] - cookies[level][0]
+            payback = rod.price / extra if extra > 0 else float("inf")
+            print(
+                f"{level:>5}  {rod.name:<24} {rod.price:>7}"
+                f" {extra:>11.2f} {payback:>14,.0f}"
+                f" {format_duration(payback * args.cooldown):>13}"
+            )
+
+
+if __name__ == "__main__":
+    main()
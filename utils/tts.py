@@ -6,7 +6,6 @@ import sys
 from typing import Any, Callable, Coroutine, Dict, List, Optional
 
 import requests
-import tomllib
 from dotenv import load_dotenv
 
 if not load_dotenv():
@@ -14,10 +13,6 @@ if not load_dotenv():
     sys.exit(1)
 tts_monster_token = os.getenv("TTS_MONSTER_TOKEN")
 
-with open("config.toml", "rb") as f:
-    config = tomllib.load(f)["tts"]
-    voice_id = config["voice"]
-
 
 def to_thread(func: Callable) -> Callable[..., Coroutine[Any, Any, Any]]:
     @functools.wraps(func)
@@ -37,7 +32,7 @@ def get_url(message: Dict[str, str]) -> str:
     return text["url"]
 
 
-def parse_input(input: str) -> List[Dict[str, str]]:
+def parse_input(input: str, voice_id: Dict[str, str]) -> List[Dict[str, str]]:
     messages = []
     parts = input.split(" ")
 
@@ -77,8 +72,8 @@ def parse_input(input: str) -> List[Dict[str, str]]:
 
 
 @to_thread
-def generate_tts(input: str) -> Optional[List[str]]:
-    messages = parse_input(input)
+def generate_tts(input: str, voice_id: Dict[str, str]) -> Optional[List[str]]:
+    messages = parse_input(input, voice_id)
 
     if get_count(messages) > 100:
         return None
@@ -91,7 +86,7 @@ def generate_tts(input: str) -> Optional[List[str]]:
     return urls
 
 
-def get_voices() -> str:
+def get_voices(voice_id: Dict[str, str]) -> str:
     return ", ".join(voice_id.keys())
 
 